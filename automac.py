@@ -6,22 +6,37 @@ import platform
 import re
 import subprocess
 import sys
+import threading
 from pathlib import Path
 
 import util
 from base import AutoMacBase
 from features.appcleaner import AppCleaner
+from features.appprofiles import AppProfiles
 from features.apps import Apps
+from features.appstore import MacAppStore
+from features.audit import Audit
+from features.backends import Backends, cli_backends
+from features.cassette import Cassette
 from features.brew import Homebrew
 from features.defaults import Defaults
 from features.exec import Exec
+from features.facts import Facts
 from features.fileassoc import FileAssoc
+from features.fleet import Fleet
+from features.fonts import Fonts
 from features.files import Files
 from features.iina import Iina
 from features.inputlang import InputLang
 from features.iterm2 import Iterm2
 from features.notifications import Notifications
+from features.power import PowerManagement
+from features.profile import Profile
+from features.restarts import Restarts
+from features.scheduler import Scheduler
+from features.watcher import Watcher
 from features.scutil import Scutil
+from features.transport import Transport
 
 debug_level = logging.DEBUG
 # debug_level = logging.INFO
@@ -29,13 +44,36 @@ debug_level = logging.DEBUG
 
 class AutoMac(AutoMacBase):
 
-    def __init__(self):
+    def __init__(self, audit: bool = None, backends: Backends = None, transport: Transport = None,
+                 cassette: Cassette = None):
+        """
+        :param audit: run read-only and report drift, see `Audit`; defaults to env var `AUTOMAC_AUDIT`
+        :param backends: how macos facilities are accessed; command-line tools by default, see `features.backends`
+        :param transport: where commands run; this machine by default, see `features.transport`
+        :param cassette: records or replays commands; by default per env vars, see `Cassette`
+        """
         logging.basicConfig(
             level=debug_level,
             format='%(levelname)-5s %(message)s'
         )
         self._lookup_dirs = []
-        self.exec = Exec(self)
+        if audit is None:
+            audit = os.environ.get('AUTOMAC_AUDIT', '') not in ('', '0')
+        self.audit = Audit(self, enabled=audit)  # type: Audit
+        self.watcher = Watcher(self)  # type: Watcher
+        self.exec = Exec(self, transport)
+        self.facts = Facts(self)  # type: Facts
+        self.restarts = Restarts(self)  # type: Restarts
+        # the account being configured; another one than ours with `UserTransport`
+        self.login = self.exec.transport.user or util.get_login()
+        self.home = self.exec.transport.home or os.path.expanduser('~')
+        self.backends = backends or cli_backends(self)  # type: Backends
+        self.backends.attach(self)
+        self.exec.cassette = cassette or Cassette.from_env()
+        if timeout := os.environ.get('AUTOMAC_TIMEOUT'):
+            self.exec.timeout = float(timeout)
+        if deadline := os.environ.get('AUTOMAC_DEADLINE'):
+            self.exec.set_deadline(float(deadline))
         self.brew = Homebrew(self)  # type: Homebrew
         self.defaults = Defaults(self)  # type: Defaults
         self.scutil = Scutil(self)  # type: Scutil
@@ -43,12 +81,21 @@ class AutoMac(AutoMacBase):
         self.fs = Files(self)  # type: Files
         self.notifications = Notifications(self)  # type: Notifications
         self.apps = Apps(self)
+        self.appstore = MacAppStore(self)  # type: MacAppStore
+        self.app_profiles = AppProfiles(self)  # type: AppProfiles
+        self.fonts = Fonts(self)  # type: Fonts
         self.appcleaner = AppCleaner(self)  # type: AppCleaner
         self.iterm2 = Iterm2(self)  # type: Iterm2
         self.iina = Iina(self)  # type: Iina
+        self.scheduler = Scheduler(self)  # type: Scheduler
+        self.profile = Profile(self)  # type: Profile
+        self.power = PowerManagement(self)  # type: PowerManagement
         self.manual_steps = []
         self.success = True
-        self._machine_serial = self._resolve_serial_number()
+        self._hardware_info = None  # populated on demand
+        self._login_items_paths = None  # populated on demand, with `_login_items_names`
+        self._login_items_names = None
+        self._login_items_lock = threading.RLock()  # scheduler steps may add items in parallel
         self._entered = False  # todo check it's true when a method called
 
     def __enter__(self):
@@ -60,9 +107,15 @@ class AutoMac(AutoMacBase):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.exec.cassette:
+            logging.info(self.exec.cassette.summary())
+        if self.audit.enabled:
+            print(json.dumps(self.audit.report(), indent=2))
+            if exc_type is None:
+                sys.exit(Audit.EXIT_CODE_DRIFT if self.audit.drift else 0 if self.success else 1)
+            return
         if self.success:
-            if self.notifications.do_reload_configs:
-                self.notifications.os_to_reload_configs()
+            self.restarts.run()
             print('OK')
         if self.manual_steps:
             print('')
@@ -70,6 +123,14 @@ class AutoMac(AutoMacBase):
             for msg in self.manual_steps:
                 print(f'- {msg}')
 
+    def enforce(self, debounce=1.0):
+        """
+        Keep running after the config is applied, restoring settings as soon as the files they live in change.
+        Call it at the end of the config. Never returns.
+        """
+        self.restarts.run()
+        self.watcher.run(debounce=debounce)
+
     def add_lookup_folder(self, path: str):
         resolved = self._prepare_lookup_dir(path, check=False)
         status = 'exists' if os.path.exists(resolved) else 'missing'
@@ -82,19 +143,21 @@ class AutoMac(AutoMacBase):
             assert os.path.exists(path), path
         return path
 
-    def _resolve_serial_number(self):
-        rc, stdout = self.exec.exec_and_capture(['system_profiler', 'SPHardwareDataType', '-json'])
-        root = json.loads(stdout)
-        return root['SPHardwareDataType'][0]['serial_number']  # todo safe read
+    def _get_hardware_info(self):
+        """
+        Output of `system_profiler SPHardwareDataType -json`; it takes a while, so only called once.
+        """
+        if self._hardware_info is None:
+            self._hardware_info = self.backends.sysconfig.hardware_info()
+        return self._hardware_info
 
     def get_machine_serial(self):
-        return self._machine_serial
+        root = json.loads(self._get_hardware_info())
+        return root['SPHardwareDataType'][0]['serial_number']  # todo safe read
 
     def is_virtual_machine(self):
         # todo seems only UTM-compatible
-        rc = self.exec.exec_temp_file(["system_profiler SPHardwareDataType -json | grep -i virtual > /dev/null"],
-                                      check=False, log=False)
-        return rc == 0
+        return 'virtual' in self._get_hardware_info().lower()
 
     def resolve_file(self, file):
         path = Path(file)
@@ -112,7 +175,27 @@ class AutoMac(AutoMacBase):
 
     def killall(self, *app_names: str):
         for app in app_names:
-            self.exec.exec(['killall', app], check=False)
+            self.backends.processes.kill(app)
+
+    def for_users(self, logins: list, config, max_workers=16):
+        """
+        Apply the user-level part of a config to several accounts at once, each by an `AutoMac` of its own;
+        system-level steps stay with this instance, so they run once. Requires root.
+        :param config: a function taking an `AutoMac`
+        :return: the merged report, see `Fleet.run`
+        """
+        report = Fleet(max_workers=max_workers, audit=self.audit.enabled).add_users(*logins).run(config)
+        if not report['success']:
+            self.success = False
+        return report
+
+    def expand_user(self, path: str):
+        """
+        Like `os.path.expanduser`, but for the account being configured.
+        """
+        if path == '~' or path.startswith('~/'):
+            return self.home + path[1:]
+        return os.path.expanduser(path)
 
     def manual_step(self, text):
         self.manual_steps.append(text)
@@ -135,7 +218,7 @@ class AutoMac(AutoMacBase):
         assert '/' not in base_name
         if not self.apps.is_app_running(base_name):
             abs_path = self.apps.resolve_app_path(app)
-            self.exec.exec(['open', abs_path])
+            self.backends.processes.open_app(abs_path)
 
     def user_shell(self, shell_path: str):
         """
@@ -144,33 +227,39 @@ class AutoMac(AutoMacBase):
         :param shell_path: like `/opt/homebrew/bin/bash`
         """
 
-        def get_current_shell():
-            rc, stdout = self.exec.exec_and_capture(['dscl', '.', '-read', f'/Users/{util.get_login()}', 'UserShell'],
+        def get_current_shell(login: str):
+            rc, stdout = self.exec.exec_and_capture(['dscl', '.', '-read', f'/Users/{login}', 'UserShell'],
                                                     check=False)
             # todo warn if rc != 0
             # stdout be like 'UserShell:   /bin/zsh'
             words = stdout.split()
             return util.get_element(words, 1)
 
-        def is_shell_registered():
-            lines = Path(etc_shells).read_text().splitlines()
-            return shell_path in lines
+        def read_lines(path: str):
+            return self.exec.native(['cat', path], Path(path).read_text, log=False, probe=True,
+                                    parse=lambda out: out).splitlines()
 
-        assert os.path.exists(shell_path)
         assert os.path.isabs(shell_path)
-        assert os.geteuid() != 0  # not root; health check
+        assert self.exec.test('-e', shell_path), shell_path
+        assert self.login != 'root'  # health check
         etc_shells = '/etc/shells'
-        assert os.path.exists(etc_shells)
-        if not is_shell_registered():
+        self.watcher.track([etc_shells], self.user_shell, shell_path)
+        assert self.exec.test('-e', etc_shells)
+        if shell_path not in self.facts.get('file_lines', read_lines, etc_shells, ttl=60):
             self.exec.sudo_temp_file([
                 'set -x',
                 f'echo "{shell_path}" | sudo tee -a {etc_shells}',
             ])
-        cur_shell = get_current_shell()
+            self.facts.invalidate('file_lines', etc_shells)
+        cur_shell = self.facts.get('user_shell', get_current_shell, self.login, ttl=60)
         if not cur_shell:
-            self.warn(f'Failed to determine login shell for user {util.get_login()}')
+            self.warn(f'Failed to determine login shell for user {self.login}')
         if shell_path != cur_shell:
-            self.exec.exec(['chsh', '-s', shell_path, util.get_login()])
+            if self.exec.transport.user:
+                self.exec.sudo(['chsh', '-s', shell_path, self.login])  # root needs no password of the user
+            else:
+                self.exec.exec_interactive(['chsh', '-s', shell_path, self.login])
+            self.facts.wrote('user_shell', self.login, value=shell_path, ttl=60)
             self.manual_step('New shell session required')
 
     def link(self, master_file: str, alias: str):
@@ -183,6 +272,26 @@ class AutoMac(AutoMacBase):
         """
         return self.fs.link(master_file, alias)
 
+    def link_tree(self, src_dir: str, dst_dir: str, rules=None, prune=False):
+        """
+        Link every file of `src_dir` into `dst_dir` in one pass, see `Files.link_tree`.
+        Example: `mac.link_tree('~/Dropbox/config/dotfiles', '~', {'bashrc.sh': '.bashrc'})`
+        """
+        return self.fs.link_tree(src_dir, dst_dir, rules, prune=prune)
+
+    def copy(self, master_file: str, target: str):
+        """
+        Copy a file if its content differs; for targets that cannot be links.
+        """
+        return self.fs.copy(master_file, target)
+
+    def render(self, template_file: str, target: str, **variables):
+        """
+        Render a template, like `hostname=$serial`, into the target if its content differs.
+        See `Files.template_variables` for the predefined variables.
+        """
+        return self.fs.copy(template_file, target, render=True, variables=variables)
+
     def mkdirs(self, *paths):
         """
         Create given directories; all necessary parents will be created also.
@@ -201,20 +310,30 @@ class AutoMac(AutoMacBase):
         else:
             # todo hide stderr
             self.exec.sudo(['systemsetup', '-settimezone', tz_name])
+            self.facts.wrote('timezone', value=tz_name, ttl=60)
 
     def get_current_timezone(self):
-        rc, path = self.exec.exec_and_capture(['readlink', '/etc/localtime'])
-        # var `path` be like '/var/db/timezone/zoneinfo/Europe/Moscow'
-        return path.replace('/var/db/timezone/zoneinfo/', '')
+        def probe():
+            path = self.exec.native(['readlink', '/etc/localtime'], os.readlink, '/etc/localtime', log=False,
+                                    probe=True, parse=str)
+            # var `path` be like '/var/db/timezone/zoneinfo/Europe/Moscow'
+            return path.replace('/var/db/timezone/zoneinfo/', '')
+
+        return self.facts.get('timezone', probe, ttl=60)
 
     def all_computer_names(self, name):
         """
         Change computer names: basic machine name, host name, local host name, samba name.
+        All names are read at once and changed by a single sudo call.
         """
-        self.computer_name(name)
-        self.host_name(name)
-        self.local_host_name(name)
-        self.samba_name(name)
+        assert name
+        with self.exec.sudo_batch():
+            self.scutil.write_all_if_needed({
+                'ComputerName': name,
+                'HostName': name,
+                'LocalHostName': name,
+            })
+            self.samba_name(name)
 
     def computer_name(self, name):
         assert name
@@ -226,7 +345,6 @@ class AutoMac(AutoMacBase):
 
     def local_host_name(self, name):
         assert name
-        # todo dots or underscores leads to error 'Invalid argument'
         self.scutil.write_if_needed('LocalHostName', name)
 
     def samba_name(self, name):
@@ -288,7 +406,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 1970-01-31.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('y-MM-dd')
 
@@ -296,7 +414,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 1970.01.31.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('y.MM.dd')
 
@@ -304,7 +422,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 1970/1/31.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('y/M/d')
 
@@ -312,7 +430,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 31-01-1970.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('dd-MM-y')
 
@@ -320,7 +438,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 31.01.1970.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('dd.MM.y')
 
@@ -328,7 +446,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 31/01/1970.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('dd/MM/y')
 
@@ -336,7 +454,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 31/1/70.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.__locale_date_format_impl('d/M/yy')
 
@@ -344,7 +462,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 1/31/70.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         # todo macos deletes AppleICUDateFormatStrings in this case; better mimic this
         self.__locale_date_format_impl('M/d/yy')
@@ -353,7 +471,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 1/31/70.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.locale_date_format_1_31_70_slashed()
 
@@ -361,7 +479,7 @@ class AutoMac(AutoMacBase):
         """
         Change date format to 1970-01-31.
         GUI: Settings / General / Language & Region / Date format.
-        Effect immediate but System Settings must be restarted to reload config.
+        Effect immediate; System Settings restarted to reload config.
         """
         self.locale_date_format_1970_01_31_dashed()
 
@@ -369,7 +487,7 @@ class AutoMac(AutoMacBase):
         # example:
         # defaults write NSGlobalDomain AppleICUDateFormatStrings -dict 1 'y-MM-dd'
         value = {'1': fmt}
-        self.defaults.write_object('NSGlobalDomain', 'AppleICUDateFormatStrings', value)
+        self.defaults.write_object('NSGlobalDomain', 'AppleICUDateFormatStrings', value, restart=['System Settings'])
 
     def locale_first_day_monday(self):
         self.defaults.write_object('NSGlobalDomain', 'AppleFirstWeekday', {'gregorian': 2})
@@ -458,15 +576,15 @@ class AutoMac(AutoMacBase):
         self.defaults.write('com.apple.dock', 'minimize-to-application', True)
 
     def dock_icon_size(self, size: int):
-        self.defaults.write('com.apple.dock', 'tilesize', size)
+        self.defaults.write('com.apple.dock', 'tilesize', size, restart=['Dock'])
 
     def dock_orientation_left(self):
-        """Works; killall Dock."""
-        self.defaults.write('com.apple.dock', 'orientation', 'left')
+        """Works; Dock restarted."""
+        self.defaults.write('com.apple.dock', 'orientation', 'left', restart=['Dock'])
 
     def dock_orientation_right(self):
-        """Works; killall Dock."""
-        self.defaults.write('com.apple.dock', 'orientation', 'right')
+        """Works; Dock restarted."""
+        self.defaults.write('com.apple.dock', 'orientation', 'right', restart=['Dock'])
 
     def trash_empty_warning_disable(self):
         # Disable the warning lang-before emptying the Trash; works; immediate
@@ -476,7 +594,7 @@ class AutoMac(AutoMacBase):
     def finder_file_extensions_show(self):
         # Finder: show all filename extensions; macos hides extension for screenshot at least; works; app restart required
         # defaults write NSGlobalDomain AppleShowAllExtensions -bool true
-        self.defaults.write('NSGlobalDomain', 'AppleShowAllExtensions', True)
+        self.defaults.write('NSGlobalDomain', 'AppleShowAllExtensions', True, restart=['Finder'])
 
     def finder_file_extensions_rename_silently(self):
         """
@@ -490,19 +608,19 @@ class AutoMac(AutoMacBase):
 
     def finder_default_folder_downloads(self):
         """Set default folder (Downloads) for a new Finder window. Effect immediate."""
-        self.finder_default_folder(str(Path.home() / 'Downloads'))
+        self.finder_default_folder(os.path.join(self.home, 'Downloads'))
 
     def finder_default_folder_desktop(self):
         """Set default folder (Desktop) for a new Finder window. Effect immediate."""
-        self.finder_default_folder(str(Path.home() / 'Desktop'))
+        self.finder_default_folder(os.path.join(self.home, 'Desktop'))
 
     def finder_default_folder(self, folder: str):
         """Set default folder for a new Finder window. Effect immediate."""
-        path = Path(folder).expanduser()
+        path = Path(self.expand_user(folder))
         assert path.is_absolute()
         assert path.exists()
         assert path.is_dir()
-        is_desktop = path.samefile(str(Path.home() / 'Desktop'))
+        is_desktop = path.samefile(os.path.join(self.home, 'Desktop'))
         self.defaults.write('com.apple.finder', 'NewWindowTarget', 'PfDe' if is_desktop else 'PfLo')
         self.defaults.write('com.apple.finder', 'NewWindowTargetPath', f'file://{path}')
 
@@ -511,8 +629,8 @@ class AutoMac(AutoMacBase):
         self.defaults.write('com.apple.finder', '_FXSortFoldersFirst', enable)
 
     def finder_path_in_title(self, enable=True):
-        """Display full path in Finder's window/tab title. Restart Finder."""
-        self.defaults.write('com.apple.finder', '_FXShowPosixPathInTitle', enable)
+        """Display full path in Finder's window/tab title. Finder restarted."""
+        self.defaults.write('com.apple.finder', '_FXShowPosixPathInTitle', enable, restart=['Finder'])
 
     def keyboard_languages(self, *langs: InputLang, keep_non_keyboard_methods=True):
         """
@@ -521,12 +639,13 @@ class AutoMac(AutoMacBase):
         """
         domain = 'com.apple.HIToolbox'
         key = 'AppleEnabledInputSources'
-        old_value = self.defaults.read(domain, key)
-        any_missing = any(lang for lang in langs if f'= {lang.get_code()};' not in old_value)  # todo poor implementation now
+        self.watcher.track([self.defaults.plist_path(domain)], self.keyboard_languages, *langs,
+                           keep_non_keyboard_methods=keep_non_keyboard_methods)
+        self.defaults.touch(domain, key, True)
+        old_value = self.backends.prefs.export(domain).get(key) or []
+        any_missing = any(lang.to_dict() not in old_value for lang in langs)
         if any_missing:
-            xmls = [lang.to_plist_xml_str() for lang in langs]
-            cmd = ['defaults', 'write', domain, key, '-array'] + xmls
-            self.exec.exec(cmd)
+            self.backends.prefs.write(domain, key, [lang.to_dict() for lang in langs])
 
     def __keyboard_languages_abc_and_ru_pc(self):
         # todo remove
@@ -558,8 +677,17 @@ class AutoMac(AutoMacBase):
         self.defaults.write('NSGlobalDomain', 'AppleKeyboardUIMode', 0)
 
     def dock_orientation_bottom(self):
-        """Works; killall Dock."""
-        self.defaults.write('com.apple.dock', 'orientation', 'bottom')
+        """Works; Dock restarted."""
+        self.defaults.write('com.apple.dock', 'orientation', 'bottom', restart=['Dock'])
+
+    def assoc_file_extensions(self, viewer: dict = None, editor: dict = None):
+        """
+        Associate apps with file types, resolving all the apps by a single osascript.
+        Example: `mac.assoc_file_extensions(editor={'Sublime Text': ['txt', 'md']}, viewer={'IINA': ['mkv']})`
+        """
+        self.assoc.extensions_many([(app_name, 'viewer', extensions) for app_name, extensions in (viewer or {}).items()]
+                                   + [(app_name, 'editor', extensions)
+                                      for app_name, extensions in (editor or {}).items()])
 
     def assoc_file_extensions_viewer(self, app_name: str, extensions: list[str]):
         """
@@ -584,37 +712,52 @@ class AutoMac(AutoMacBase):
         pass
 
     def file_exists(self, path: str):
-        path = Path(path).expanduser()
-        return path.exists()
+        return os.path.exists(self.expand_user(path))
 
     def get_app_bundle_id(self, app_name_or_path: str):
         """
         :param app_name_or_path:
         :return: bundle id; or throw exception if app not found
         """
-        rc, bundle_id = self.exec.exec_and_capture(['osascript', '-e', f'id of app "{app_name_or_path}"'])
-        return bundle_id
+        return self.backends.launch_services.bundle_id(app_name_or_path)
+
+    def get_app_bundle_ids(self, *app_names_or_paths: str):
+        """
+        Resolve several apps at once, by a single osascript.
+        :return: like {'IINA': 'com.colliderli.iina'}; or throw exception if an app not found
+        """
+        return self.backends.launch_services.bundle_ids(list(app_names_or_paths))
 
     def quarantine_remove_app(self, app_name: str):
         self.apps.remove_app_from_quarantine(app_name)
 
     def get_xattrs(self, path: str):
-        assert os.path.exists(path)
-        rc, stdout = self.exec.exec_and_capture(['xattr', path])
-        return stdout.splitlines()
+        """
+        :return: attribute names; cached, so copy the list before changing it
+        """
+        assert not self.exec.reads_local_files or os.path.exists(path)
+        return self.facts.get('xattrs', lambda path: self.exec.native(
+            ['xattr', path], util.list_xattrs, path, log=False, probe=True, parse=str.splitlines), path, ttl=60)
 
     def get_mac_version_str(self):
-        return platform.mac_ver()[0]
+        """
+        :return: like '14.7.1'; of the Mac being configured
+        """
+        return self.facts.get('mac_version_str', lambda: self.exec.native(
+            ['sw_vers', '-productVersion'], lambda: platform.mac_ver()[0], log=False, probe=True, parse=str.strip))
 
     def get_mac_version(self):
         """
         Return current macos version as a three-int tuple.
         """
-        tup = platform.mac_ver()[0].split('.')
-        tup = list(map(util.str_to_int_or_zero, tup))
-        while len(tup) < 3:
-            tup.append(0)
-        return tuple(tup)
+        def probe():
+            tup = self.get_mac_version_str().split('.')
+            tup = list(map(util.str_to_int_or_zero, tup))
+            while len(tup) < 3:
+                tup.append(0)
+            return tuple(tup)
+
+        return self.facts.get('mac_version', probe)  # changes by a reboot only
 
     def screen_lock_off(self, password: str = None):
         """
@@ -623,9 +766,13 @@ class AutoMac(AutoMacBase):
         """
         # XXX sysadminctl prints current status to stderr bsr
         # XXX password '-' means that user will be asked for it in prompt
-        rc, text = self.exec.exec_and_capture(['sysadminctl', '-screenLock', 'status'], stderr=subprocess.STDOUT)
-        if 'screenLock is off' not in text:
-            self.exec.exec(['sysadminctl', '-screenLock', 'off', '-password', password if password else '-'])
+        def probe():
+            rc, text = self.exec.exec_and_capture(['sysadminctl', '-screenLock', 'status'], stderr=subprocess.STDOUT)
+            return 'screenLock is off' in text
+
+        if not self.facts.get('screen_lock_off', probe, ttl=60):
+            self.exec.exec_interactive(['sysadminctl', '-screenLock', 'off', '-password', password if password else '-'])
+            self.facts.wrote('screen_lock_off', value=True, ttl=60)
 
     def desktop_iphone_widgets_disable(self):
         """
@@ -643,31 +790,69 @@ class AutoMac(AutoMacBase):
         Make an app running at startup.
         :param app_path: an absolute path like `/Applications/TopNotch.app`
         """
-        assert os.path.isabs(app_path), app_path
-        assert os.path.exists(app_path), app_path
-        bn = util.app_name_to_base_name_without_ext(app_path)
-        cur_items = self.login_items_list()
-        if bn not in cur_items:
-            self._login_items_add_impl(app_path)
+        self.login_items(app_path)
+
+    def login_items(self, *app_paths: str):
+        """
+        Make apps running at startup.
+        Current items are listed once per run; all missing ones are added by a single AppleScript.
+        :param app_paths: absolute paths like `/Applications/TopNotch.app`
+        """
+        for app_path in app_paths:
+            assert os.path.isabs(app_path), app_path
+            assert os.path.exists(app_path), app_path
+        with self._login_items_lock:
+            self._load_login_items()
+            cur_paths = self._login_items_paths
+            missing = [path for path in dict.fromkeys(app_paths) if path.rstrip('/') not in cur_paths]
+            if missing:
+                self._login_items_add_impl(*missing)
+                if not self.audit.enabled:
+                    cur_paths.update(path.rstrip('/') for path in missing)
+                    self._login_items_names.extend(os.path.splitext(os.path.basename(path.rstrip('/')))[0]
+                                                   for path in missing)
+
+    def login_items_paths(self):
+        """
+        Return current login items in form of {'/Applications/Dropbox.app', ...}.
+        Cached for the run; `login_items` keeps it up to date.
+        """
+        with self._login_items_lock:
+            self._load_login_items()
+            return set(self._login_items_paths)
 
     def login_items_list(self):
         """
         Return current list of login items in form of ['Dropbox', 'TopNotch'].
         No full paths or uniq ids.
         """
-        rc, out = self.exec.exec_osa_script('''tell application "System Events" to get the name of every login item''',
-                                            log=False)
-        items = out.split(',')
-        items = list(map(str.strip, items))
-        items = list(filter(bool, items))
-        return items
+        with self._login_items_lock:
+            self._load_login_items()
+            return list(self._login_items_names)
+
+    def _load_login_items(self):
+        # paths and names by a single osascript
+        if self._login_items_paths is None:
+            batch = self.exec.osa_batch()
+            paths = batch.add('tell application "System Events" to get the path of every login item')
+            names = batch.add('tell application "System Events" to get the name of every login item')
+            batch.run()
+            self._login_items_paths = {line.strip().rstrip('/') for line in paths.result.splitlines() if line.strip()}
+            self._login_items_names = [name.strip() for name in names.result.splitlines() if name.strip()]
 
-    def _login_items_add_impl(self, app_path: str):
+    def _login_items_add_impl(self, *app_paths: str):
         """
-        Add a new login item.
-        :param app_path: full path to an app, like '/Applications/TopNotch.app'
+        Add new login items.
+        :param app_paths: full paths to apps, like '/Applications/TopNotch.app'
         """
         # not sure what param `hidden` means
         # subsequent addition has no effect, 14.7
-        text = f'''tell application "System Events" to make login item at end with properties {{path:"{app_path}", hidden:true}}'''
-        self.exec.exec_osa_script(text)
+        self.exec.exec_osa_script('\n'.join([
+            'on run argv',
+            'tell application "System Events"',
+            'repeat with appPath in argv',
+            'make login item at end with properties {path:(appPath as text), hidden:true}',
+            'end repeat',
+            'end tell',
+            'end run',
+        ]), args=app_paths)
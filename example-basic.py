@@ -5,11 +5,10 @@ from automac import AutoMac
 from features.inputlang import InputLangs
 
 
-def cask_full(cask, app, enable_notifications=True):
+def cask_full(cask, app):
     if not mac.apps.app_exists(app):
         mac.brew.install_cask(cask)
     mac.quarantine_remove_app(app)
-    mac.notifications.change_app(app, enable_notifications)
 
 
 with AutoMac() as mac:
@@ -28,6 +27,7 @@ with AutoMac() as mac:
     # mac.brew.install_casks('brew-cask-basic.txt')
     # app.brew.install_formulas('brew-formula-basic.txt')
     mac.brew.install_formulas('brew-formula-mini.txt')
+    # mac.brew.reconcile('brew-formula-basic.txt', 'brew-cask-basic.txt', dry_run=True)  # exactly these, nothing else
 
     mac.mkdirs('~/bin', '~/.secrets', '~/venv', '~/tmp', '~/projects')
     mac.link('~/Dropbox', '~/d')
@@ -111,7 +111,10 @@ with AutoMac() as mac:
     # cask_full('dbeaver-community', 'DBeaver')
     # cask_full('openmtp', 'OpenMTP')
 
-    mac.notifications.enable_app(
+    # apps are resolved by a single osascript
+    mac.notifications.enable_apps(
+        'Dropbox', 'AppCleaner', 'IINA.app', 'iTerm.app', 'KeePassXC.app', 'Sublime Text.app', 'Telegram.app',
+        'TopNotch.app',
         '/Applications/Brave Browser.app/Contents/Frameworks/Brave Browser Framework.framework/Versions/Current/Helpers/Brave Browser Helper (Alerts).app')
 
     (mac.notifications
@@ -127,23 +130,22 @@ with AutoMac() as mac:
     text_files = 'ahk bash bat cfg css groovy gradle java js json kt log m md nfo php properties ps1 py rb reg sh sublime-syntax todo treetop txt xml yaml yml csv srt vtt'.split()
     video_files = 'avi divx flv m4v mkv mov mp4 mpg vob webm wmv'.split()
     audio_files = 'aac aif aiff ape fla flac m4a mp3 ogg wav wma'.split()
-    mac.assoc_file_extensions_editor('Sublime Text', text_files)
-    mac.assoc_file_extensions_viewer('IINA', video_files)
-    mac.assoc_file_extensions_viewer('IINA', audio_files)
+    mac.assoc_file_extensions(editor={'Sublime Text': text_files}, viewer={'IINA': video_files + audio_files})
 
     # todo `plist` - WARNING Failed reassigning `plist` from `com.apple.dt.Xcode` to `com.sublimetext.4` with role `editor`. Probably you want a stronger role: `editor` or `all`
     # mac.assoc_file_extensions_editor('Sublime Text', ['plist'])
 
-    (mac.appcleaner
-     .update_disable()
-     .analytics_off()
-     .mark_as_launched_before())
-
-    (mac.iterm2
-     .update_disable()
-     .analytics_off()
-     .quit_silently()
-     .quit_when_all_windows_closed())
+    with mac.defaults.batch():  # a single read and write per app
+        (mac.appcleaner
+         .update_disable()
+         .analytics_off()
+         .mark_as_launched_before())
+
+        (mac.iterm2
+         .update_disable()
+         .analytics_off()
+         .quit_silently()
+         .quit_when_all_windows_closed())
 
     (mac.iina
      .quit_when_all_windows_closed()
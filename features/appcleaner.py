@@ -1,4 +1,10 @@
+from features.appprofiles import AppProfiles
+
+
 class AppCleaner:
+    """
+    Sparkle settings of AppCleaner. Called inside `Defaults.batch`, the chained setters cost one import.
+    """
     DOMAIN = 'net.freemacsoft.AppCleaner'
 
     def __init__(self, app):
@@ -7,14 +13,13 @@ class AppCleaner:
         self.app = app
 
     def update_disable(self):
-        self.app.defaults.write(self.DOMAIN, 'SUAutomaticallyUpdate', False)
-        self.app.defaults.write(self.DOMAIN, 'SUEnableAutomaticChecks', False)
+        self.app.app_profiles.apply([self.DOMAIN], AppProfiles.UPDATES_OFF)
         return self
 
     def mark_as_launched_before(self):
-        self.app.defaults.write(self.DOMAIN, 'SUHasLaunchedBefore', True)
+        self.app.app_profiles.apply([self.DOMAIN], AppProfiles.LAUNCHED_BEFORE)
         return self
 
     def analytics_off(self):
-        self.app.defaults.write(self.DOMAIN, 'SUSendProfileInfo', False)
+        self.app.app_profiles.apply([self.DOMAIN], AppProfiles.ANALYTICS_OFF)
         return self
@@ -0,0 +1,70 @@
+import logging
+import os
+import plistlib
+
+
+class AppProfiles:
+    """
+    Preference sets shared by many apps, like those of the Sparkle update framework.
+    Every app domain is read once and written at once, see `Defaults.merge`.
+
+    Usage:
+        mac.app_profiles.apply(['com.googlecode.iterm2'], AppProfiles.UPDATES_OFF, AppProfiles.ANALYTICS_OFF)
+        mac.app_profiles.apply_to_sparkle_apps(AppProfiles.UPDATES_OFF)
+    """
+    UPDATES_OFF = {'SUAutomaticallyUpdate': False, 'SUEnableAutomaticChecks': False}
+    ANALYTICS_OFF = {'SUSendProfileInfo': False}
+    LAUNCHED_BEFORE = {'SUHasLaunchedBefore': True}  # no "check for updates automatically?" prompt
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+
+    def apply(self, bundle_ids: list, *profiles: dict):
+        """
+        :param bundle_ids: app domains, like ['net.freemacsoft.AppCleaner']
+        :param profiles: like `AppProfiles.UPDATES_OFF`; merged in order
+        """
+        values = {}
+        for profile in profiles:
+            values.update(profile)
+        # one domain after another: a domain is rewritten as a whole, see `Scheduler` for parallel writes
+        for bundle_id in bundle_ids:
+            self.app.defaults.merge(bundle_id, values)
+
+    def apply_to_sparkle_apps(self, *profiles: dict):
+        """
+        Apply profiles to every app in /Applications updated by Sparkle.
+        """
+        bundle_ids = sorted(self.sparkle_apps())
+        logging.debug(f'Sparkle apps found: {len(bundle_ids)}')
+        self.apply(bundle_ids, *profiles)
+
+    def sparkle_apps(self):
+        """
+        :return: like {'com.googlecode.iterm2': '/Applications/iTerm.app'}
+        """
+        result = {}
+        for app_path in self.app.apps.index().values():
+            info = self._read_info_plist(app_path)
+            bundle_id = info.get('CFBundleIdentifier')
+            if bundle_id and self._uses_sparkle(app_path, info):
+                result[bundle_id] = app_path
+        return result
+
+    def _read_info_plist(self, app_path: str):
+        path = os.path.join(app_path, 'Contents', 'Info.plist')
+        try:
+            if self.app.exec.reads_local_files:
+                with open(path, 'rb') as fd:
+                    return plistlib.load(fd)
+            rc, out = self.app.exec.exec_and_capture(['plutil', '-convert', 'xml1', '-o', '-', path], check=False)
+            return plistlib.loads(out.encode('utf-8')) if rc == 0 else {}
+        except (OSError, plistlib.InvalidFileException):
+            return {}
+
+    def _uses_sparkle(self, app_path: str, info: dict):
+        # the feed url may be set in code, but the framework is bundled anyway
+        return 'SUFeedURL' in info or self.app.exec.test(
+            '-d', os.path.join(app_path, 'Contents', 'Frameworks', 'Sparkle.framework'))
@@ -1,5 +1,9 @@
+import logging
 import os
-import subprocess
+
+from features import xattrs
+
+APPLICATIONS = '/Applications'
 
 
 class Apps:
@@ -7,17 +11,39 @@ class Apps:
         from automac import AutoMac
         app: AutoMac = app
         self.app = app
+        self._index = None  # populated on demand
+
+    def index(self):
+        """
+        Apps in /Applications, listed once per run; installers call `invalidate_index` afterwards.
+        :return: like {'sublime text': '/Applications/Sublime Text.app'}
+        """
+        if self._index is None:
+            index = {}
+            if self.app.exec.test('-d', APPLICATIONS):
+                names = self.app.exec.native(['ls', APPLICATIONS], os.listdir, APPLICATIONS, log=False, probe=True,
+                                             parse=str.splitlines)
+                for name in names:
+                    if name.endswith('.app'):
+                        index[name[:-len('.app')].lower()] = os.path.join(APPLICATIONS, name)
+            self._index = index
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
+
+    def is_installed(self, app_name: str):
+        """
+        :param app_name: like 'Sublime Text', case insensitive
+        """
+        return app_name.lower().removesuffix('.app') in self.index()
 
     def is_app_running(self, app_base_name):
         """
         :param app_base_name: like 'Sublime Text'
         :return:
         """
-        # todo pgrep matches not only 'TopNotch' but 'TopNot' too
-        rc = self.app.exec.exec_interactive(['pgrep', app_base_name], check=False, stdout=subprocess.PIPE,
-                                            stderr=subprocess.PIPE,
-                                            log=False)
-        return rc == 0
+        return self.app.backends.processes.is_running(app_base_name)
 
     def resolve_app_path(self, app_name: str):
         """
@@ -28,7 +54,6 @@ class Apps:
         """
         app_path = self.find_app_path(app_name)
         assert app_path, f'No app found by app name {app_name}'
-        assert os.path.exists(app_path), app_path
         return app_path
 
     def find_app_path(self, app_name: str):
@@ -44,14 +69,31 @@ class Apps:
             if not app_name.endswith('.app'):
                 app_name = f'{app_name}.app'
             app_path = f'/Applications/{app_name}'
-        return app_path if os.path.exists(app_path) else None
+        return app_path if self.app.exec.test('-e', app_path) else None
 
     def app_exists(self, app_name: str):
         path = self.find_app_path(app_name)
         return bool(path)
 
-    def remove_app_from_quarantine(self, app_name: str):
+    def remove_app_from_quarantine(self, app_name: str, deep=False):
+        """
+        Remove the quarantine attribute from the whole app bundle, without spawning `xattr` for it.
+        :param deep: look beneath the bundle even if the bundle itself is not quarantined
+        :return: a number of files cleaned
+        """
         app_path = self.app.apps.resolve_app_path(app_name)
-        xattrs = self.app.get_xattrs(app_path)
-        if 'com.apple.quarantine' in xattrs:
-            self.app.exec.exec(['xattr', '-dr', 'com.apple.quarantine', app_path])
+        if xattrs.QUARANTINE not in self.app.get_xattrs(app_path):
+            local = self.app.exec.reads_local_files
+            if not deep or local and not xattrs.exists_recursive(app_path, xattrs.QUARANTINE):
+                return 0
+        cmd = ['xattr', '-dr', xattrs.QUARANTINE, app_path]
+        result = self.app.exec.native(cmd, xattrs.remove_recursive, app_path, xattrs.QUARANTINE)
+        self.app.facts.invalidate('xattrs')  # any file of the bundle
+        if result is None:
+            return 0  # audit mode, or done by the command
+        cleaned, failed = result
+        logging.debug(f'Quarantine removed from {cleaned} files of {app_path}')
+        if failed:
+            logging.debug(f'Failed to clean {len(failed)} files natively, like {failed[0]}')
+            self.app.exec.exec(cmd)
+        return cleaned
@@ -0,0 +1,113 @@
+import logging
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+
+
+class MacAppStore:
+    """
+    Installs App Store apps by their ids, with `mas` (`brew install mas`); a user must be signed in.
+    An id is the number in the app's store link: apps.apple.com/app/xcode/id497799835
+
+    Usage:
+        mac.appstore.install({497799835: 'Xcode', 1295203466: 'Microsoft Remote Desktop'})
+    """
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self._installed = None  # populated on demand
+        self._mas_exe = None  # populated on demand
+        self._lock = threading.Lock()
+
+    @property
+    def mas_exe(self):
+        if self._mas_exe is None:
+            # resolved via PATH, so a stub can stand in for it
+            if self.app.exec.reads_local_files:
+                path = shutil.which('mas')
+            else:
+                rc, out = self.app.exec.exec_and_capture(['which', 'mas'], check=False)
+                path = out if rc == 0 else None
+            if not path and self.app.exec.replaying:
+                path = 'mas'
+            if not path:
+                self.app.abort('mas not found; install it by `brew install mas`')
+            self._mas_exe = path
+        return self._mas_exe
+
+    @property
+    def installed(self):
+        """
+        :return: like {497799835: 'Xcode'}
+        """
+        if self._installed is None:
+            rc, out = self.app.exec.exec_and_capture([self.mas_exe, 'list'])
+            self._installed = parse_mas_list(out)
+        return self._installed
+
+    def install(self, apps: Union[dict, list], max_workers=3):
+        """
+        Install the missing apps, a few at a time.
+        :param apps: ids, like [497799835]; or ids with app names, like {497799835: 'Xcode'},
+            then an app already in /Applications is skipped even if it didn't come from the store
+        :param max_workers: downloads at the same time
+        """
+        if not isinstance(apps, dict):
+            apps = dict.fromkeys(apps)
+        missing = {}
+        for app_id, name in apps.items():
+            if int(app_id) in self.installed:
+                continue
+            if name and self.app.apps.is_installed(name):
+                logging.debug(f'Not from App Store but already exists: {name} - skip')
+                continue
+            missing[int(app_id)] = name
+        if not missing:
+            return
+        started = time.monotonic()
+        total = len(missing)
+        done = []
+        failed = []
+
+        def install_one(app_id: int, name: str):
+            title = f'{name} ({app_id})' if name else str(app_id)
+            logging.info(f'App Store: installing {title}')
+            app_started = time.monotonic()
+            rc = self.app.exec.exec([self.mas_exe, 'install', str(app_id)], check=False)
+            with self._lock:
+                if rc == 0:
+                    done.append(app_id)
+                    if not self.app.audit.enabled:
+                        self.installed[app_id] = name or ''
+                else:
+                    failed.append(title)
+                logging.info(f'App Store: [{len(done) + len(failed)}/{total}] {title} '
+                             f'{"installed" if rc == 0 else "FAILED"} in {time.monotonic() - app_started:.1f} sec')
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for future in [pool.submit(install_one, app_id, name) for app_id, name in missing.items()]:
+                future.result()
+        self.app.apps.invalidate_index()
+        logging.info(f'App Store: {len(done)} of {total} apps installed in {time.monotonic() - started:.1f} sec')
+        if failed:
+            self.app.abort(f'App Store installs failed: {", ".join(failed)}')
+
+
+def parse_mas_list(text: str):
+    """
+    Parse the output of `mas list`:
+        497799835   Xcode                      (15.4)
+        1295203466  Microsoft Remote Desktop   (10.9.8)
+    :return: like {497799835: 'Xcode', 1295203466: 'Microsoft Remote Desktop'}
+    """
+    result = {}
+    for line in text.splitlines():
+        m = re.match(r'\s*(\d+)\s+(.*?)\s*(\([^)]*\))?\s*$', line)
+        if m:
+            result[int(m.group(1))] = m.group(2)
+    return result
@@ -0,0 +1,50 @@
+import logging
+import threading
+import time
+
+
+class Audit:
+    """
+    Read-only drift audit: a config runs as usual, but every mutating call
+    is recorded as a "would change" entry instead of being executed.
+
+    Enabled by `AutoMac(audit=True)` or env var `AUTOMAC_AUDIT=1`.
+    The run prints a JSON drift report and exits with code 2 if anything drifted.
+    """
+    EXIT_CODE_DRIFT = 2
+
+    def __init__(self, app, enabled=False):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self.enabled = enabled
+        self.changes = []
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+
+    def skip(self, action: str, kind='exec'):
+        """
+        Record a mutation if auditing.
+        :param action: like 'defaults write com.apple.dock orientation -string left'
+        :param kind: like 'exec', 'sudo', 'native'
+        :return: True if the caller must not perform the mutation
+        """
+        if not self.enabled:
+            return False
+        logging.info(f'WOULD CHANGE: {action}')
+        with self._lock:
+            self.changes.append({'kind': kind, 'action': action})
+        return True
+
+    @property
+    def drift(self):
+        return bool(self.changes)
+
+    def report(self):
+        return {
+            'drift': self.drift,
+            'success': self.app.success,
+            'changes': self.changes,
+            'manual_steps': self.app.manual_steps,
+            'duration_sec': round(time.monotonic() - self._started, 3),
+        }
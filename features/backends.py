@@ -0,0 +1,713 @@
+"""
+Backends do the actual talking to macos facilities: preferences, system config, launch services,
+processes and packages. Features decide *what* to change; backends know *how*.
+
+- `cli_backends`: the default one, runs the standard command-line tools
+- `file_backends`: reads and writes plist files directly where possible, CLI for the rest
+- `SimulatedMac`: an in-memory Mac for Linux tests and benchmarks, no processes at all
+"""
+import json
+import os
+import plistlib
+import shlex
+import shutil
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+from typing import Optional, Union
+from xml.etree.ElementTree import Element
+
+import util
+from features.osa import BUNDLE_ID_QUERY
+from features.power import parse_pmset_custom
+
+
+class PrefsBackend:
+    """
+    Preference domains, like `defaults` does them.
+    """
+
+    def read(self, domain: str, key: str, current_host=False) -> Optional[str]:
+        """:return: a value as `defaults read` prints it, like '1' for True; None if missing"""
+        raise Exception('not implemented')
+
+    def export(self, domain: str, current_host=False) -> dict:
+        """:return: the whole domain; empty if missing"""
+        raise Exception('not implemented')
+
+    def import_domain(self, domain: str, values: dict, current_host=False, sudo=False):
+        """
+        Replace the whole domain at once, like `defaults import` does.
+        """
+        raise Exception('not implemented')
+
+    def write(self, domain: str, key: str, value, current_host=False, sudo=False):
+        raise Exception('not implemented')
+
+    def delete(self, domain: str, key: str):
+        raise Exception('not implemented')
+
+
+class SysconfigBackend:
+    """
+    System configuration, like `scutil` does it, and hardware info.
+    """
+
+    def get_all(self, keys) -> dict:
+        """:return: like {'ComputerName': 'bmp', 'HostName': None}; None for a missing setting"""
+        raise Exception('not implemented')
+
+    def set(self, key: str, value: str):
+        raise Exception('not implemented')
+
+    def hardware_info(self) -> str:
+        """:return: JSON text as printed by `system_profiler SPHardwareDataType -json`"""
+        raise Exception('not implemented')
+
+    def power_settings(self) -> dict:
+        """:return: like {'ac': {'sleep': 1, ...}, 'battery': {...}}, see `power.parse_pmset_custom`"""
+        raise Exception('not implemented')
+
+    def set_power(self, source: str, values: dict):
+        """
+        :param source: 'ac', 'battery' or 'ups'
+        :param values: like {'sleep': 0, 'displaysleep': 10}
+        """
+        raise Exception('not implemented')
+
+
+class LaunchServicesBackend:
+    """
+    App identities and file type handlers.
+    """
+
+    def bundle_id(self, app_name_or_path: str) -> str:
+        raise Exception('not implemented')
+
+    def bundle_ids(self, app_names_or_paths: list) -> dict:
+        """:return: like {'IINA': 'com.colliderli.iina'}"""
+        return {name: self.bundle_id(name) for name in app_names_or_paths}
+
+    def get_handler(self, ext: str) -> str:
+        """:return: a bundle id handling files with extension `ext`, like 'com.apple.TextEdit'; '' if unknown"""
+        raise Exception('not implemented')
+
+    def set_handler(self, bundle_id: str, ext: str, role: str):
+        raise Exception('not implemented')
+
+
+class ProcessBackend:
+    def is_running(self, name: str) -> bool:
+        raise Exception('not implemented')
+
+    def kill(self, name: str):
+        raise Exception('not implemented')
+
+    def open_app(self, app_path: str):
+        raise Exception('not implemented')
+
+
+class PackageBackend:
+    """
+    Homebrew-like package management.
+    """
+
+    def list_installed(self) -> set:
+        """:return: lower-case names of installed formulas and casks"""
+        raise Exception('not implemented')
+
+    def info(self, package: str) -> tuple:
+        """:return: (exit code, text) like `brew info` gives"""
+        raise Exception('not implemented')
+
+    def install(self, package: str, cask=False):
+        raise Exception('not implemented')
+
+    def list_leaves(self) -> set:
+        """:return: lower-case names of formulas installed on request that no other formula depends on"""
+        raise Exception('not implemented')
+
+    def list_casks(self) -> set:
+        """:return: lower-case names of installed casks"""
+        raise Exception('not implemented')
+
+    def install_all(self, packages: list, cask=False):
+        """Install packages by a single call."""
+        raise Exception('not implemented')
+
+    def uninstall_all(self, packages: list, cask=False):
+        """Uninstall packages by a single call."""
+        raise Exception('not implemented')
+
+    def autoremove(self):
+        """Uninstall formulas which were installed as dependencies and aren't needed anymore."""
+        raise Exception('not implemented')
+
+
+class Backends:
+    def __init__(self, prefs: PrefsBackend, sysconfig: SysconfigBackend, launch_services: LaunchServicesBackend,
+                 processes: ProcessBackend, packages: PackageBackend):
+        self.prefs = prefs
+        self.sysconfig = sysconfig
+        self.launch_services = launch_services
+        self.processes = processes
+        self.packages = packages
+
+    def attach(self, app):
+        """
+        Give the app to backends made before it, like those of `SimulatedMac`.
+        """
+        for backend in (self.prefs, self.sysconfig, self.launch_services, self.processes, self.packages):
+            if isinstance(backend, MemoryBackend) and backend.app is None:
+                backend.app = app
+
+
+def defaults_text(value) -> str:
+    """
+    Format a scalar the way `defaults read` prints it.
+    """
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+def to_plist_xml(value: Union[list, dict]):
+    """
+    :param value: like {'1': 'y.MM.dd'}
+    :return: like '<dict><key>1</key><string>y.MM.dd</string></dict>'
+    """
+    xml_str_1 = plistlib.dumps(value).decode('utf-8')
+    root = ET.fromstring(xml_str_1)  # type: Element
+    assert len(root) == 1
+    first_child = root[0]
+    xml_str_2 = ET.tostring(first_child).decode('utf-8')
+    # todo strip \r\n\t only btw tags
+    xml_str_2 = xml_str_2.replace('\r', '').replace('\n', '').replace('\t', '')
+    return xml_str_2
+
+
+# CLI, the default
+
+
+class CliPrefsBackend(PrefsBackend):
+    def __init__(self, app):
+        self.app = app
+        self._exports = {}  # (domain, current_host) -> values or None; audit mode only, when nothing changes
+        self._exports_lock = threading.Lock()
+
+    def read(self, domain: str, key: str, current_host=False):
+        if domain.startswith('/') and not current_host and self.app.exec.reads_local_files:
+            # a plain file, like '/Library/Preferences/SystemConfiguration/com.apple.smb.server'
+            try:
+                with open(domain if domain.endswith('.plist') else f'{domain}.plist', 'rb') as fd:
+                    value = plistlib.load(fd).get(key)
+                if value is None or isinstance(value, (str, int, float)):
+                    return None if value is None else defaults_text(value)
+            except (OSError, plistlib.InvalidFileException):
+                pass
+        if self.app.audit.enabled:
+            values = self._export_once(domain, current_host)
+            if values is not None:
+                value = values.get(key)
+                if value is None or isinstance(value, (str, int)):
+                    return None if value is None else defaults_text(value)
+        ch = '-currentHost' if current_host else None
+        rc, value = self.app.exec.exec_and_capture(util.drop_nones(['defaults', ch, 'read', domain, key]), check=False)
+        return value if rc == 0 else None
+
+    def _export_once(self, domain: str, current_host: bool) -> Optional[dict]:
+        """
+        A whole domain read by one process, so an audit checking many keys of it costs one process.
+        :return: None if the domain can't be exported
+        """
+        with self._exports_lock:
+            if (domain, current_host) in self._exports:
+                return self._exports[(domain, current_host)]
+        ch = '-currentHost' if current_host else None
+        rc, text = self.app.exec.exec_and_capture(util.drop_nones(['defaults', ch, 'export', domain, '-']),
+                                                  check=False)
+        try:
+            values = plistlib.loads(text.encode('utf-8')) if rc == 0 else None
+        except plistlib.InvalidFileException:
+            values = None
+        with self._exports_lock:
+            self._exports[(domain, current_host)] = values
+        return values
+
+    def export(self, domain: str, current_host=False):
+        ch = '-currentHost' if current_host else None
+        rc, cur_xml_text = self.app.exec.exec_and_capture(util.drop_nones(['defaults', ch, 'export', domain, '-']))
+        # todo check rc
+        return plistlib.loads(cur_xml_text.encode('utf-8'))
+
+    def import_domain(self, domain: str, values: dict, current_host=False, sudo=False):
+        ch = '-currentHost' if current_host else None
+        xml_text = plistlib.dumps(values).decode('utf-8')
+        cmd = util.drop_nones(['defaults', ch, 'import', domain, '-'])
+        if self.app.audit.skip(shlex.join(cmd), kind='sudo' if sudo else 'exec'):
+            return
+        if sudo:
+            # sudo may read a password from stdin, so the plist goes in a here-document of the script
+            self.app.exec.sudo_temp_file([f"{shlex.join(cmd)} <<'AUTOMAC_PLIST'", xml_text.rstrip('\n'),
+                                          'AUTOMAC_PLIST'])
+            return
+        self.app.exec.exec_and_capture(cmd, input=xml_text, log=True)
+
+    def write(self, domain: str, key: str, value, current_host=False, sudo=False):
+        ch = '-currentHost' if current_host else None
+        if isinstance(value, (list, dict)):
+            args = [to_plist_xml(value)]
+        else:
+            type_ = {str: '-string', int: '-int', bool: '-bool'}[type(value)]
+            args = [type_, str(value).lower() if isinstance(value, bool) else str(value)]
+        cmd = util.drop_nones(['defaults', ch, 'write', domain, key] + args)
+        if sudo:
+            self.app.exec.sudo(cmd)
+        else:
+            self.app.exec.exec(cmd)
+
+    def delete(self, domain: str, key: str):
+        self.app.exec.exec(['defaults', 'delete', domain, key])
+
+
+class CliSysconfigBackend(SysconfigBackend):
+    # scutil keeps computer names here; the file is world-readable, so no process needed to read them
+    PREFERENCES_PLIST = '/Library/Preferences/SystemConfiguration/preferences.plist'
+    KEY_PATHS = {
+        'ComputerName': ['System', 'System', 'ComputerName'],
+        'HostName': ['System', 'System', 'HostName'],
+        'LocalHostName': ['System', 'Network', 'HostNames', 'LocalHostName'],
+    }
+
+    def __init__(self, app):
+        self.app = app
+
+    def get_all(self, keys):
+        prefs = self._load_preferences() if self.app.exec.reads_local_files else None
+        result = {}
+        for key in keys:
+            if prefs is not None and key in self.KEY_PATHS:
+                result[key] = self._dig(prefs, self.KEY_PATHS[key])
+            else:
+                # XXX scutil exits with a non-zero code if setting missing
+                rc, value = self.app.exec.exec_and_capture(['scutil', '--get', key], check=False)
+                result[key] = value if rc == 0 else None
+        return result
+
+    def _load_preferences(self):
+        try:
+            with open(self.PREFERENCES_PLIST, 'rb') as fd:
+                return plistlib.load(fd)
+        except (OSError, plistlib.InvalidFileException):
+            return None
+
+    @staticmethod
+    def _dig(value, path: list):
+        for name in path:
+            value = value.get(name) if isinstance(value, dict) else None
+        return value
+
+    def set(self, key: str, value: str):
+        self.app.exec.sudo(['scutil', '--set', key, value])
+
+    def hardware_info(self):
+        rc, stdout = self.app.exec.exec_and_capture(['system_profiler', 'SPHardwareDataType', '-json'])
+        return stdout
+
+    def power_settings(self):
+        rc, stdout = self.app.exec.exec_and_capture(['pmset', '-g', 'custom'])
+        return parse_pmset_custom(stdout)
+
+    def set_power(self, source: str, values: dict):
+        flag = {'ac': '-c', 'battery': '-b', 'ups': '-u'}[source]
+        args = [str(arg) for key, value in values.items() for arg in (key, value)]
+        self.app.exec.sudo(['pmset', flag] + args)
+
+
+class CliLaunchServicesBackend(LaunchServicesBackend):
+    # todo check duti installed
+    # todo resolve path to duti in runtime
+    DUTI = '/opt/homebrew/bin/duti'
+
+    def __init__(self, app):
+        self.app = app
+        self._bundle_ids = {}  # app name or path -> bundle id
+
+    def bundle_id(self, app_name_or_path: str):
+        return self.bundle_ids([app_name_or_path])[app_name_or_path]
+
+    def bundle_ids(self, app_names_or_paths: list):
+        # bundle ids don't change during a run
+        missing = [name for name in dict.fromkeys(app_names_or_paths) if name not in self._bundle_ids]
+        if missing:
+            batch = self.app.exec.osa_batch()
+            queries = {name: batch.add(BUNDLE_ID_QUERY, name) for name in missing}
+            batch.run()
+            self._bundle_ids.update((name, query.result) for name, query in queries.items())
+        return {name: self._bundle_ids[name] for name in app_names_or_paths}
+
+    def get_handler(self, ext: str):
+        rc, cur_settings = self.app.exec.exec_and_capture([self.DUTI, '-x', ext], check=False)
+        # Example of `duti -x txt` output:
+        #   TextEdit.app
+        #   /System/Applications/TextEdit.app
+        #   com.apple.TextEdit
+        lines = cur_settings.splitlines()
+        if rc != 0 or len(lines) < 3:
+            return ''
+        return lines[2]  # like 'com.apple.TextEdit'
+
+    def set_handler(self, bundle_id: str, ext: str, role: str):
+        self.app.exec.exec([self.DUTI, '-s', bundle_id, f'.{ext}', role])
+
+
+class CliProcessBackend(ProcessBackend):
+    def __init__(self, app):
+        self.app = app
+
+    def is_running(self, name: str):
+        # todo pgrep matches not only 'TopNotch' but 'TopNot' too
+        rc, _ = self.app.exec.exec_and_capture(['pgrep', name], check=False)
+        return rc == 0
+
+    def kill(self, name: str):
+        self.app.exec.exec(['killall', name], check=False)
+
+    def open_app(self, app_path: str):
+        self.app.exec.exec(['open', app_path])
+
+
+class CliPackageBackend(PackageBackend):
+    def __init__(self, app):
+        self.app = app
+
+    def list_installed(self):
+        _, stdout = self.app.exec.exec_and_capture([self.app.brew.brew_exe, 'list'])
+        return {line.strip().lower() for line in stdout.splitlines()}
+
+    def info(self, package: str):
+        return self.app.exec.exec_and_capture([self.app.brew.brew_exe, 'info', package], check=False)
+
+    def install(self, package: str, cask=False):
+        cask_arg = '--cask' if cask else None
+        # casks with a pkg installer ask for a password
+        self.app.exec.exec_interactive(util.drop_nones([self.app.brew.brew_exe, 'install', cask_arg, package]))
+
+    def list_leaves(self):
+        _, stdout = self.app.exec.exec_and_capture([self.app.brew.brew_exe, 'leaves', '--installed-on-request'])
+        return {line.strip().lower() for line in stdout.splitlines() if line.strip()}
+
+    def list_casks(self):
+        _, stdout = self.app.exec.exec_and_capture([self.app.brew.brew_exe, 'list', '--cask', '-1'])
+        return {line.strip().lower() for line in stdout.splitlines() if line.strip()}
+
+    def install_all(self, packages: list, cask=False):
+        cask_arg = '--cask' if cask else None
+        self.app.exec.exec_interactive(util.drop_nones([self.app.brew.brew_exe, 'install', cask_arg, *packages]))
+
+    def uninstall_all(self, packages: list, cask=False):
+        cask_arg = '--cask' if cask else None
+        # casks with a pkg uninstaller ask for a password
+        self.app.exec.exec_interactive(util.drop_nones([self.app.brew.brew_exe, 'uninstall', cask_arg, *packages]))
+
+    def autoremove(self):
+        self.app.exec.exec([self.app.brew.brew_exe, 'autoremove'])
+
+
+def cli_backends(app):
+    return Backends(CliPrefsBackend(app), CliSysconfigBackend(app), CliLaunchServicesBackend(app),
+                    CliProcessBackend(app), CliPackageBackend(app))
+
+
+# plist files
+
+
+class PlistFilePrefsBackend(PrefsBackend):
+    """
+    Reads and writes preference plists directly.
+    XXX cfprefsd caches preferences of a logged-in user, so direct writes may be lost or overwritten;
+    use it for offline trees like a mounted disk image, or for reading.
+    """
+
+    def __init__(self, app, prefs_dir='~/Library/Preferences', host_id='automac'):
+        self.app = app
+        self.prefs_dir = app.expand_user(prefs_dir)
+        self.host_id = host_id  # the hardware UUID in ByHost file names
+
+    def _path(self, domain: str, current_host=False):
+        if domain.startswith('/'):
+            return domain if domain.endswith('.plist') else f'{domain}.plist'
+        name = '.GlobalPreferences' if domain == 'NSGlobalDomain' else domain
+        if current_host:
+            return os.path.join(self.prefs_dir, 'ByHost', f'{name}.{self.host_id}.plist')
+        return os.path.join(self.prefs_dir, f'{name}.plist')
+
+    def _load(self, domain: str, current_host=False):
+        try:
+            with open(self._path(domain, current_host), 'rb') as fd:
+                return plistlib.load(fd)
+        except FileNotFoundError:
+            return {}
+
+    def _save(self, domain: str, values: dict, current_host=False):
+        path = self._path(domain, current_host)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _dump_atomic(values, path, fmt=plistlib.FMT_BINARY)
+
+    def read(self, domain: str, key: str, current_host=False):
+        value = self._load(domain, current_host).get(key)
+        return None if value is None else defaults_text(value)
+
+    def export(self, domain: str, current_host=False):
+        return self._load(domain, current_host)
+
+    def import_domain(self, domain: str, values: dict, current_host=False, sudo=False):
+        if self.app.audit.skip(shlex.join(['defaults', 'import', self._path(domain, current_host), '-']),
+                               kind='native'):
+            return
+        self._save(domain, values, current_host)
+
+    def write(self, domain: str, key: str, value, current_host=False, sudo=False):
+        path = self._path(domain, current_host)
+        if self.app.audit.skip(shlex.join(['defaults', 'write', path, key, defaults_text(value)]), kind='native'):
+            return
+        values = self._load(domain, current_host)
+        values[key] = value
+        self._save(domain, values, current_host)
+
+    def delete(self, domain: str, key: str):
+        if self.app.audit.skip(shlex.join(['defaults', 'delete', self._path(domain), key]), kind='native'):
+            return
+        values = self._load(domain)
+        if values.pop(key, None) is not None:
+            self._save(domain, values)
+
+
+class PlistFileSysconfigBackend(CliSysconfigBackend):
+    """
+    Reads and writes scutil settings in the preferences plist; needs root for writing.
+    """
+
+    def __init__(self, app, plist_path=CliSysconfigBackend.PREFERENCES_PLIST):
+        super().__init__(app)
+        self.PREFERENCES_PLIST = plist_path
+
+    def set(self, key: str, value: str):
+        if self.app.audit.skip(shlex.join(['scutil', '--set', key, value]), kind='native'):
+            return
+        with open(self.PREFERENCES_PLIST, 'rb') as fd:
+            prefs = plistlib.load(fd)
+        node = prefs
+        *parents, name = self.KEY_PATHS[key]
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = value
+        _dump_atomic(prefs, self.PREFERENCES_PLIST)
+
+
+def _dump_atomic(values: dict, path: str, fmt=plistlib.FMT_XML):
+    """
+    Replace a plist at once, so a reader never sees it half-written; the file mode is kept.
+    """
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            plistlib.dump(values, f, fmt=fmt)
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            os.chmod(temp_path, 0o644)  # mkstemp creates private files
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def file_backends(app, prefs_dir='~/Library/Preferences'):
+    return Backends(PlistFilePrefsBackend(app, prefs_dir), PlistFileSysconfigBackend(app), CliLaunchServicesBackend(app),
+                    CliProcessBackend(app), CliPackageBackend(app))
+
+
+# in memory
+
+
+class MemoryBackend:
+    """
+    A mutation of the simulated Mac is audited like the command it stands for.
+    State is guarded by a lock, as scheduler steps run in parallel.
+    """
+    app = None  # set by `Backends.attach`
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def _skip(self, cmd: list):
+        return self.app is not None and self.app.audit.skip(shlex.join(cmd), kind='native')
+
+
+class MemoryPrefsBackend(PrefsBackend, MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.domains = {}  # (domain, current_host) -> dict
+
+    def read(self, domain: str, key: str, current_host=False):
+        with self._lock:
+            value = self.domains.get((domain, current_host), {}).get(key)
+        return None if value is None else defaults_text(value)
+
+    def export(self, domain: str, current_host=False):
+        with self._lock:
+            return dict(self.domains.get((domain, current_host), {}))
+
+    def import_domain(self, domain: str, values: dict, current_host=False, sudo=False):
+        if self._skip(util.drop_nones(['defaults', '-currentHost' if current_host else None, 'import', domain, '-'])):
+            return
+        with self._lock:
+            self.domains[(domain, current_host)] = dict(values)
+
+    def write(self, domain: str, key: str, value, current_host=False, sudo=False):
+        ch = '-currentHost' if current_host else None
+        if self._skip(util.drop_nones(['defaults', ch, 'write', domain, key, defaults_text(value)])):
+            return
+        with self._lock:
+            self.domains.setdefault((domain, current_host), {})[key] = value
+
+    def delete(self, domain: str, key: str):
+        if self._skip(['defaults', 'delete', domain, key]):
+            return
+        with self._lock:
+            self.domains.get((domain, False), {}).pop(key, None)
+
+
+class MemorySysconfigBackend(SysconfigBackend, MemoryBackend):
+    def __init__(self, hardware: dict):
+        super().__init__()
+        self.values = {}
+        self.hardware = hardware
+        self.power = {'ac': {}}  # a desktop Mac; add 'battery' for a laptop
+
+    def get_all(self, keys):
+        with self._lock:
+            return {key: self.values.get(key) for key in keys}
+
+    def set(self, key: str, value: str):
+        if self._skip(['scutil', '--set', key, value]):
+            return
+        with self._lock:
+            self.values[key] = value
+
+    def hardware_info(self):
+        return json.dumps({'SPHardwareDataType': [self.hardware]})
+
+    def power_settings(self):
+        with self._lock:
+            return {source: dict(values) for source, values in self.power.items()}
+
+    def set_power(self, source: str, values: dict):
+        flag = {'ac': '-c', 'battery': '-b', 'ups': '-u'}[source]
+        if self._skip(['pmset', flag] + [str(arg) for key, value in values.items() for arg in (key, value)]):
+            return
+        with self._lock:
+            self.power.setdefault(source, {}).update(values)
+
+
+class MemoryLaunchServicesBackend(LaunchServicesBackend, MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.known = {}  # app name or path -> bundle id
+        self.handlers = {}  # ext -> bundle id
+
+    def bundle_id(self, app_name_or_path: str):
+        name = util.app_name_to_base_name_without_ext(app_name_or_path)
+        return self.known.get(app_name_or_path) or self.known.get(name) or f'simulated.{name}'
+
+    def get_handler(self, ext: str):
+        return self.handlers.get(ext, '')
+
+    def set_handler(self, bundle_id: str, ext: str, role: str):
+        if self._skip(['duti', '-s', bundle_id, f'.{ext}', role]):
+            return
+        with self._lock:
+            self.handlers[ext] = bundle_id
+
+
+class MemoryProcessBackend(ProcessBackend, MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.running = set()
+
+    def is_running(self, name: str):
+        return name in self.running
+
+    def kill(self, name: str):
+        if self._skip(['killall', name]):
+            return
+        with self._lock:
+            self.running.discard(name)
+
+    def open_app(self, app_path: str):
+        if self._skip(['open', app_path]):
+            return
+        with self._lock:
+            self.running.add(util.app_name_to_base_name_without_ext(app_path))
+
+
+class MemoryPackageBackend(PackageBackend, MemoryBackend):
+    def __init__(self):
+        super().__init__()
+        self.installed = set()
+        self.casks = set()  # a part of `installed`; no dependencies here, so every formula is a leaf
+
+    def list_installed(self):
+        with self._lock:
+            return set(self.installed)
+
+    def info(self, package: str):
+        if package.lower() in self.installed:
+            return 0, package
+        return 0, f'{package}\nNot installed'
+
+    def install(self, package: str, cask=False):
+        if self._skip(util.drop_nones(['brew', 'install', '--cask' if cask else None, package])):
+            return
+        with self._lock:
+            self.installed.add(package.lower())
+            if cask:
+                self.casks.add(package.lower())
+
+    def list_leaves(self):
+        with self._lock:
+            return self.installed - self.casks
+
+    def list_casks(self):
+        with self._lock:
+            return set(self.casks)
+
+    def install_all(self, packages: list, cask=False):
+        if self._skip(util.drop_nones(['brew', 'install', '--cask' if cask else None, *packages])):
+            return
+        for package in packages:
+            self.install(package, cask=cask)
+
+    def uninstall_all(self, packages: list, cask=False):
+        if self._skip(util.drop_nones(['brew', 'uninstall', '--cask' if cask else None, *packages])):
+            return
+        with self._lock:
+            for package in packages:
+                self.installed.discard(package.lower())
+                self.casks.discard(package.lower())
+
+    def autoremove(self):
+        pass
+
+
+class SimulatedMac(Backends):
+    """
+    A Mac living in memory: `AutoMac(backends=SimulatedMac())` runs a config with no macos tools.
+    Inspect `prefs.domains`, `sysconfig.values` and so on afterwards.
+    """
+
+    def __init__(self, serial='SIMULATED01', model='Apple Virtual Machine 1'):
+        super().__init__(MemoryPrefsBackend(),
+                         MemorySysconfigBackend({'serial_number': serial, 'machine_name': model}),
+                         MemoryLaunchServicesBackend(), MemoryProcessBackend(), MemoryPackageBackend())
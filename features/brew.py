@@ -1,7 +1,7 @@
 import logging
 import os
 import re
-import subprocess
+import threading
 
 import util
 
@@ -15,20 +15,17 @@ class Homebrew:
         app: AutoMac = app
         self.app = app
         self.installed_packages_ = None  # populated on demand
+        self._lock = threading.Lock()  # scheduler steps install in parallel
 
     @property
     def installed_packages(self):
-        if self.installed_packages_ is None:
-            self.installed_packages_ = self._list_installed_packages()
-        return self.installed_packages_
+        with self._lock:
+            if self.installed_packages_ is None:
+                self.installed_packages_ = self._list_installed_packages()
+            return self.installed_packages_
 
     def _list_installed_packages(self):
-        cmd_str = f'{self.brew_exe} list'
-        p = subprocess.run(cmd_str, shell=True, check=False, capture_output=True, encoding='utf-8')
-        assert p.returncode == 0, f'Shell command failed: {cmd_str}'
-        packages = p.stdout.splitlines()
-        packages = [x.strip().lower() for x in packages]
-        return set(packages)
+        return self.app.backends.packages.list_installed()
 
     def install_homebrew(self):
         if not self._brew_exists():
@@ -51,8 +48,7 @@ class Homebrew:
     def install_formulas(self, list_file: str):
         list_file = self.app.resolve_file(list_file)
         logging.debug(f'Installing brew formulas from {list_file}')
-        lines = util.read_file_lines(list_file)
-        lines = list(filter(lambda line: line and ('#' not in line), lines))
+        lines = self._read_list(list_file)
         cnt = 0
         for package in lines:
             self.install_formula(package)
@@ -64,13 +60,12 @@ class Homebrew:
         if package_lo in self.installed_packages:
             # print(f'Already installed: {package}')
             return
-        self.app.exec.exec([self.brew_exe, 'install', package])
+        self.app.backends.packages.install(package)
 
     def install_casks(self, list_file: str):
         list_file = self.app.resolve_file(list_file)
         logging.debug(f'Installing brew casks from {list_file}')
-        lines = util.read_file_lines(list_file)
-        lines = list(filter(lambda line: line and ('#' not in line), lines))
+        lines = self._read_list(list_file)
         cnt = 0
         for package in lines:
             self.install_cask(package)
@@ -90,10 +85,82 @@ class Homebrew:
             logging.debug(f'No cask `{package}` installed but macos apps already exists: {existing_macos_apps} - skip')
             return
         # self.setup_manager.exec_string(f'brew install --cask {package}')
-        self.app.exec.exec([self.brew_exe, 'install', '--cask', package])
+        self.app.backends.packages.install(package, cask=True)
+
+    def reconcile(self, formulas_file: str = None, casks_file: str = None, dry_run=False):
+        """
+        Make the installed packages exactly those listed: install the missing ones, uninstall the others,
+        then the dependencies nothing needs anymore (`brew autoremove`). Each step is a single `brew` call.
+        :param formulas_file: like 'brew-formula-basic.txt'; installed formulas are left alone if None
+        :param casks_file: the same for casks
+        :param dry_run: only log the plan
+        :return: the plan, see `plan`
+        """
+        plan = self.plan(formulas_file, casks_file)
+        for title, packages in plan.items():
+            if packages:
+                logging.info(f'Brew plan: {title.replace("_", " ")}: {" ".join(packages)}')
+        if not any(plan.values()):
+            logging.info('Brew plan: nothing to change')
+        if plan['uninstall_formulas'] or plan['uninstall_casks']:
+            logging.info('Brew plan: then `brew autoremove`')
+        if dry_run:
+            return plan
+        backend = self.app.backends.packages
+        if plan['uninstall_casks']:
+            backend.uninstall_all(plan['uninstall_casks'], cask=True)
+        if plan['uninstall_formulas']:
+            backend.uninstall_all(plan['uninstall_formulas'])
+        if plan['uninstall_formulas'] or plan['uninstall_casks']:
+            backend.autoremove()
+            self.installed_packages_ = None
+            if formulas_file:
+                # a listed formula installed as a dependency only may have gone with autoremove
+                plan['install_formulas'] = self._missing(self._read_list(self.app.resolve_file(formulas_file)))
+        if plan['install_formulas']:
+            backend.install_all(plan['install_formulas'])
+        if plan['install_casks']:
+            backend.install_all(plan['install_casks'], cask=True)
+        self.installed_packages_ = None
+        return plan
+
+    def plan(self, formulas_file: str = None, casks_file: str = None):
+        """
+        Compare the list files against the installed leaf formulas and casks, see `reconcile`.
+        :return: like {'install_formulas': ['jq'], 'install_casks': [], 'uninstall_formulas': ['wget'],
+            'uninstall_casks': ['zoom']}
+        """
+        backend = self.app.backends.packages
+        plan = {'install_formulas': [], 'install_casks': [], 'uninstall_formulas': [], 'uninstall_casks': []}
+        if formulas_file:
+            formulas = self._read_list(self.app.resolve_file(formulas_file))
+            wanted = {_short_name(package) for package in formulas}
+            plan['install_formulas'] = self._missing(formulas)
+            plan['uninstall_formulas'] = sorted(package for package in backend.list_leaves()
+                                                if _short_name(package) not in wanted)
+        if casks_file:
+            casks = self._read_list(self.app.resolve_file(casks_file))
+            wanted = {_short_name(package) for package in casks}
+            for package in self._missing(casks):
+                installed_via_brew, existing_macos_apps = self._check_existing_brew_cask(package)
+                if installed_via_brew or existing_macos_apps:
+                    logging.debug(f'Cask `{package}` is not installed but its apps exist: {existing_macos_apps} - skip')
+                    continue
+                plan['install_casks'].append(package)
+            plan['uninstall_casks'] = sorted(package for package in backend.list_casks()
+                                             if _short_name(package) not in wanted)
+        return plan
+
+    def _missing(self, packages: list):
+        return [package for package in packages if _short_name(package) not in self.installed_packages]
+
+    @staticmethod
+    def _read_list(list_file):
+        lines = util.read_file_lines(list_file)
+        return list(filter(lambda line: line and ('#' not in line), lines))
 
     def _check_existing_brew_cask(self, package):
-        rc, stdout = self.app.exec.exec_and_capture([self.brew_exe, 'info', package], check=False)
+        rc, stdout = self.app.backends.packages.info(package)
         installed_via_brew = rc == 0 and 'Not installed' not in stdout
         existing_macos_apps = self._find_macos_apps(stdout)
         return installed_via_brew, existing_macos_apps
@@ -122,7 +189,17 @@ class Homebrew:
             self.app.abort('Brew not found')
 
     def _find_brew_executable(self):
-        for path in ['/opt/homebrew/bin/brew', '/usr/local/bin/brew']:
+        paths = ['/opt/homebrew/bin/brew', '/usr/local/bin/brew']
+        for path in paths:
             if os.path.exists(path):
                 return path
+        if self.app.exec.replaying:
+            return paths[0]  # recorded on a mac, most likely an Apple Silicon one
         return None
+
+
+def _short_name(package: str):
+    """
+    :return: a package name without its tap, like 'font-inter' for 'homebrew/cask-fonts/font-inter'
+    """
+    return package.lower().rsplit('/', 1)[-1]
@@ -0,0 +1,157 @@
+import base64
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+
+class Cassette:
+    """
+    Records every command run by `Exec` (with its stdin, output, exit code and timing) into a file,
+    or replays such a file instead of running anything, so a config can be re-run on Linux.
+
+    The file has one JSON object per line; it's gzipped if the name ends with '.gz'.
+    Only processes are recorded; syscalls like `os.path.exists` still hit the local file system.
+
+    Enabled by env vars `AUTOMAC_RECORD=file` or `AUTOMAC_REPLAY=file`.
+    """
+
+    @classmethod
+    def from_env(cls, host: str = None):
+        """
+        :param host: a fleet host, it gets a file of its own: 'run.jsonl.gz' becomes 'run.mini1.jsonl.gz'
+        :return: a cassette if enabled by env vars, or None
+        """
+        for var, replay in (('AUTOMAC_REPLAY', True), ('AUTOMAC_RECORD', False)):
+            if path := os.environ.get(var):
+                if host:
+                    folder, name = os.path.split(path)
+                    stem, dot, ext = name.partition('.')
+                    host = re.sub(r'[^\w-]', '_', host)  # like 'admin_mini1_local'
+                    path = os.path.join(folder, f'{stem}.{host}{dot}{ext}')
+                return cls(path, replay=replay)
+        return None
+
+    def __init__(self, path: str, replay: bool):
+        self.path = path
+        self.replay = replay
+        self.stats = collections.Counter()  # program -> calls
+        self.recorded_sec = 0.0  # how long the calls took during recording
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> deque of entries
+        if replay:
+            self._load()
+        else:
+            with self._open('wt'):
+                pass  # truncate
+
+    def record(self, cmd, stdin, rc: int, stdout, stderr, duration: float):
+        entry = {
+            'cmd': self._normalize(cmd),
+            'stdin': self._encode(stdin),
+            'rc': rc,
+            'stdout': self._encode(stdout),
+            'stderr': self._encode(stderr),
+            'ms': round(duration * 1000, 1),
+        }
+        with self._lock:
+            self._count(entry)
+            with self._open('at') as fd:
+                fd.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    def play(self, cmd, stdin):
+        """
+        :return: (rc, stdout, stderr) as recorded; rc 127 for an unknown command
+        """
+        key = self._key(self._normalize(cmd), self._encode(stdin))
+        with self._lock:
+            queue = self._entries.get(key)
+            if not queue:
+                self.misses += 1
+                logging.warning(f'Not in cassette: {key[0]}')
+                return 127, b'', b''
+            # the last answer is repeated for any further identical calls
+            entry = queue.popleft() if len(queue) > 1 else queue[0]
+            self._count(entry)
+        return entry['rc'], self._decode(entry['stdout']), self._decode(entry['stderr'])
+
+    def summary(self):
+        """
+        Like 'cassette: 42 calls, 3.1 s recorded; defaults 30, scutil 3, ...'.
+        Comparing summaries of two runs shows how many calls an optimization removed.
+        """
+        programs = ', '.join(f'{name} {cnt}' for name, cnt in self.stats.most_common())
+        misses = f', {self.misses} missing' if self.misses else ''
+        return (f'cassette: {sum(self.stats.values())} calls, {self.recorded_sec:.1f} s recorded{misses}; '
+                f'{programs}')
+
+    def _count(self, entry):
+        cmd = entry['cmd']
+        words = cmd.split() if isinstance(cmd, str) else cmd
+        if words[:3] == ['sudo', '-S', '--'] and len(words) > 3:
+            program = f'sudo {os.path.basename(words[3])}'
+        else:
+            program = os.path.basename(words[0]) if words else ''
+        self.stats[program] += 1
+        self.recorded_sec += entry['ms'] / 1000
+
+    def _load(self):
+        with self._open('rt') as fd:
+            for line in fd:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(self._key(entry['cmd'], entry['stdin']),
+                                             collections.deque()).append(entry)
+        # stats count the replayed calls only
+        self.recorded_sec = 0.0
+
+    def _open(self, mode):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode, encoding='utf-8')
+        return open(self.path, mode, encoding='utf-8')
+
+    @staticmethod
+    def _key(cmd, stdin):
+        return json.dumps(cmd), json.dumps(stdin)
+
+    @staticmethod
+    def _normalize(cmd):
+        """
+        Temp files have random names, so they are identified by their content.
+        """
+        if isinstance(cmd, str):
+            return cmd
+        temp_dir = tempfile.gettempdir()
+        result = []
+        for arg in cmd:
+            arg = str(arg)
+            if arg.startswith(temp_dir) and os.path.isfile(arg):
+                with open(arg, 'rb') as fd:
+                    arg = f'<temp:{hashlib.sha256(fd.read()).hexdigest()[:16]}>'
+            result.append(arg)
+        return result
+
+    @staticmethod
+    def _encode(data):
+        if data is None:
+            return None
+        if isinstance(data, str):
+            return data
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return {'b64': base64.b64encode(data).decode('ascii')}
+
+    @staticmethod
+    def _decode(data):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            return base64.b64decode(data['b64'])
+        return data.encode('utf-8')
@@ -1,9 +1,11 @@
-import plistlib
-import xml.etree.ElementTree as ET
+import contextlib
+import copy
+import logging
+import os
+import threading
 from typing import Union
-from xml.etree.ElementTree import Element
 
-import util
+from features.backends import defaults_text
 
 
 class Defaults:
@@ -15,13 +17,71 @@ class Defaults:
         from automac import AutoMac
         app: AutoMac = app
         self.app = app
+        self.touched = {}  # (domain, current_host) -> {key: True if written, False if deleted}; for profiles
+        self.sudo_domains = set()  # (domain, current_host) written as root
+        self._lock = threading.Lock()  # scheduler steps write in parallel
+        self._batch = threading.local()
+
+    def touch(self, domain: str, key: str, written: bool, current_host=False, sudo=False):
+        """
+        Remember a key the config manages, so `Profile.export` includes it; called for keys written elsewhere too.
+        """
+        with self._lock:
+            self.touched.setdefault((domain, current_host), {})[key] = written
+            if sudo:
+                self.sudo_domains.add((domain, current_host))
+
+    def touched_domains(self):
+        """
+        :return: a copy of `touched` with a flag of a root-owned domain,
+            like {('com.apple.dock', False): ({'autohide': True}, False)}
+        """
+        with self._lock:
+            return {domain: (dict(keys), domain in self.sudo_domains) for domain, keys in self.touched.items()}
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Collect `merge` calls made inside the block and apply them at the end of it, a single merge per domain,
+        so a domain is read and written once however many setters changed it.
+
+        Usage:
+            with mac.defaults.batch():
+                mac.iterm2.update_disable().analytics_off().quit_silently()
+        """
+        if getattr(self._batch, 'patches', None) is not None:
+            yield  # nested: the outer batch applies everything
+            return
+        self._batch.patches = {}  # (domain, current_host, sudo_write) -> (patch, restart)
+        try:
+            yield
+            patches = self._batch.patches
+        finally:
+            self._batch.patches = None
+        for (domain, current_host, sudo_write), (patch, restart) in patches.items():
+            self.merge(domain, patch, current_host=current_host, sudo_write=sudo_write, restart=restart)
+
+    def plist_path(self, domain: str, current_host=False):
+        """
+        A file where a domain is stored, for watching.
+        :param domain: like 'com.apple.dock', 'NSGlobalDomain' or '/Library/Preferences/com.apple.xxx'
+        :return: like '~/Library/Preferences/com.apple.dock.plist';
+            the ByHost folder for `current_host`, as its file names contain the hardware UUID
+        """
+        if domain.startswith('/'):
+            return domain if domain.endswith('.plist') else f'{domain}.plist'
+        prefs_dir = os.path.join(self.app.home, 'Library/Preferences')
+        if current_host:
+            return os.path.join(prefs_dir, 'ByHost')
+        name = '.GlobalPreferences' if domain == 'NSGlobalDomain' else domain
+        return os.path.join(prefs_dir, f'{name}.plist')
 
     def read(self, domain: str, key: str):
-        cmd = ['defaults', 'read', domain, key]
-        rc, value = self.app.exec.exec_and_capture(cmd, check=False)
-        return value if rc == 0 else ''
+        value = self.app.backends.prefs.read(domain, key)
+        return value if value is not None else ''
 
-    def write(self, domain: str, key: str, value: Union[str, int, bool], current_host=False, sudo_write=False):
+    def write(self, domain: str, key: str, value: Union[str, int, bool], current_host=False, sudo_write=False,
+              restart=()):
         """
         Write a value into domain/key if not written yet.
         :param domain:
@@ -29,75 +89,134 @@ class Defaults:
         :param value:
         :param current_host:
         :param sudo_write:
+        :param restart: processes to restart if written, like ['Dock'], see `Restarts`
         :return:
         """
-
-        def norm(val):
-            if isinstance(val, bool):
-                return '1' if val else '0'
-            return str(val)
-
-        def str_value(val):
-            if isinstance(val, bool):
-                return str(val).lower()
-            return str(val)
-
         assert value is not None
-        type_ = {str: '-string', int: '-int', bool: '-bool'}[type(value)]
-        ch = '-currentHost' if current_host else None
-        cmd = util.drop_nones(['defaults', ch, 'read', domain, key])
-        rc, old_value = self.app.exec.exec_and_capture(cmd, check=False)
-        if rc == 0 and norm(value) == norm(old_value):
-            # print(f'Already done: {domain} {key} {type_} {new_value}')
+        assert type(value) in (str, int, bool), value
+        self.app.watcher.track([self.plist_path(domain, current_host)], self.write, domain, key, value,
+                               current_host=current_host, sudo_write=sudo_write, restart=restart)
+        self.touch(domain, key, True, current_host=current_host, sudo=sudo_write)
+        prefs = self.app.backends.prefs
+        old_value = prefs.read(domain, key, current_host=current_host)
+        if old_value is not None and defaults_text(value) == old_value:
+            # print(f'Already done: {domain} {key} {new_value}')
             pass
         else:
-            cmd = util.drop_nones(['defaults', ch, 'write', domain, key, type_, str_value(value)])
-            if sudo_write:
-                self.app.exec.sudo(cmd)
-            else:
-                self.app.exec.exec(cmd)
+            prefs.write(domain, key, value, current_host=current_host, sudo=sudo_write)
+            self.app.restarts.require(*restart)
 
-    def write_object(self, domain: str, key: str, new_value: Union[list, dict]):
+    def write_object(self, domain: str, key: str, new_value: Union[list, dict], restart=()):
         """
         Write a value into domain/key if not written yet.
         :param domain:
         :param key:
         :param new_value:
+        :param restart: see `write`
         :return:
         """
-
-        def dict_to_plist_xml(value: dict):
-            """
-            :param value: like {'1': 'y.MM.dd'}
-            :return: like '<dict><key>1</key><string>y.MM.dd</string></dict>'
-            """
-            xml_str_1 = plistlib.dumps(value).decode('utf-8')
-            root = ET.fromstring(xml_str_1)  # type: Element
-            assert len(root) == 1
-            first_child = root[0]
-            xml_str_2 = ET.tostring(first_child).decode('utf-8')
-            # todo strip \r\n\t only btw tags
-            xml_str_2 = xml_str_2.replace('\r', '').replace('\n', '').replace('\t', '')
-            return xml_str_2
-
         assert new_value is not None
-        rc, cur_xml_text = self.app.exec.exec_and_capture(['defaults', 'export', domain, '-'])
-        # todo check rc
-        xml = plistlib.loads(cur_xml_text.encode('utf-8'))
-        cur_value = xml.get(key)
+        self.app.watcher.track([self.plist_path(domain)], self.write_object, domain, key, new_value, restart=restart)
+        self.touch(domain, key, True)
+        prefs = self.app.backends.prefs
+        cur_value = prefs.export(domain).get(key)
         if cur_value is None or new_value != cur_value:
-            new_value_xml_str = dict_to_plist_xml(new_value)
-            self.app.exec.exec(['defaults', 'write', domain, key, new_value_xml_str])
+            prefs.write(domain, key, new_value)
+            self.app.restarts.require(*restart)
 
-    def delete_key(self, domain: str, key: str):
+    def write_path(self, domain: str, key_path: str, value, current_host=False, sudo_write=False, restart=()):
+        """
+        Write a value deep inside a structure, keeping the rest of it.
+        :param key_path: like 'AppleSymbolicHotKeys.64.enabled'; array items are addressed by index,
+            like 'persistent-apps.0.tile-type'
+        """
+        patch = value
+        for name in reversed(key_path.split('.')):
+            patch = {name: patch}
+        self.merge(domain, patch, current_host=current_host, sudo_write=sudo_write, restart=restart)
+
+    def merge(self, domain: str, patch: dict, current_host=False, sudo_write=False, restart=()):
+        """
+        Deep-merge values into a domain: dicts are merged key by key, anything else replaces the value.
+        The domain is read once; if anything differs, it's rewritten at once.
+        :param patch: like {'AppleSymbolicHotKeys': {'64': {'enabled': False}, '65': {'enabled': False}}}
+        :param restart: see `write`
+        """
+        patches = getattr(self._batch, 'patches', None)
+        if patches is not None:
+            pending, pending_restart = patches.setdefault((domain, current_host, sudo_write), ({}, []))
+            apply_paths(pending, diff_paths(pending, patch))
+            pending_restart.extend(name for name in restart if name not in pending_restart)
+            return
+        self.app.watcher.track([self.plist_path(domain, current_host)], self.merge, domain, patch,
+                               current_host=current_host, sudo_write=sudo_write, restart=restart)
+        for key in patch:
+            self.touch(domain, key, True, current_host=current_host, sudo=sudo_write)
+        prefs = self.app.backends.prefs
+        values = prefs.export(domain, current_host=current_host)
+        changes = diff_paths(values, patch)
+        if not changes:
+            return
+        for path, value in changes:
+            logging.debug(f'Change {domain}: {".".join(map(str, path))} = {value!r}')
+        apply_paths(values, changes)
+        prefs.import_domain(domain, values, current_host=current_host, sudo=sudo_write)
+        self.app.restarts.require(*restart)
+
+    def delete_key(self, domain: str, key: str, restart=()):
         """
         Delete a value by the given domain/key if one exists.
         :param domain:
         :param key:
+        :param restart: see `write`
         :return:
         """
-        cmd = ['defaults', 'read', domain, key]
-        rc, value = self.app.exec.exec_and_capture(cmd, check=False)
-        key_exists = rc == 0
+        self.app.watcher.track([self.plist_path(domain)], self.delete_key, domain, key, restart=restart)
+        self.touch(domain, key, False)
+        prefs = self.app.backends.prefs
+        key_exists = prefs.read(domain, key) is not None
         if key_exists:
-            self.app.exec.exec(['defaults', 'delete', domain, key])
+            prefs.delete(domain, key)
+            self.app.restarts.require(*restart)
+
+
+def diff_paths(current: Union[dict, list], patch: dict, path=()):
+    """
+    The least changes making `current` contain `patch`.
+    :return: like [(('AppleSymbolicHotKeys', '64', 'enabled'), False)]; list indexes are ints
+    """
+    changes = []
+    for name, value in patch.items():
+        key = _node_key(current, name)
+        exists = key in current if isinstance(current, dict) else key < len(current)
+        cur_value = current[key] if exists else None
+        if isinstance(value, dict) and isinstance(cur_value, (dict, list)):
+            changes += diff_paths(cur_value, value, path + (key,))
+        # XXX True == 1 in python, but not in a plist
+        elif not exists or cur_value != value or type(cur_value) is not type(value):
+            changes.append((path + (key,), value))
+    return changes
+
+
+def apply_paths(root: dict, changes: list):
+    """
+    Make the changes found by `diff_paths`, in place.
+    """
+    for path, value in changes:
+        node = root
+        for key in path[:-1]:
+            node = node[key]
+        key = path[-1]
+        if isinstance(node, list) and key == len(node):
+            node.append(copy.deepcopy(value))
+        else:
+            node[key] = copy.deepcopy(value)
+
+
+def _node_key(node: Union[dict, list], name):
+    if isinstance(node, list):
+        index = int(name)
+        if not 0 <= index <= len(node):
+            raise IndexError(f'No item {name} in an array of {len(node)}')
+        return index
+    return str(name)
@@ -1,29 +1,194 @@
+import collections
+import contextlib
+import contextvars
 import logging
+import os
+import select
 import shlex
+import signal
 import subprocess
 import tempfile
-from pathlib import Path
-from typing import Union
+import threading
+import time
+from typing import Optional, Union
+
+from features.cassette import Cassette
+from features.osa import OsaBatch, compile_cached
+from features.transport import LocalTransport, Transport
 
 
 class Exec:
+    TAIL_LINES = 20  # output lines kept for error messages
 
-    def __init__(self, app):
+    def __init__(self, app, transport: Transport = None):
         from automac import AutoMac
         app: AutoMac = app
         self.app = app
+        self.transport = transport or LocalTransport()  # type: Transport
+        self._probe_cache = {}  # cmd -> (rc, stdout); used in audit mode only, when nothing changes
+        self._probe_cache_lock = threading.Lock()
+        self.cassette = None  # type: Optional[Cassette]
+        self._sudo_batch = threading.local()
+        self.timeout = None  # type: Optional[float]  # seconds, for commands which don't talk to the terminal
+        self.deadline = None  # type: Optional[float]  # time.monotonic() by which the whole run must be done
+
+    @property
+    def replaying(self):
+        return bool(self.cassette and self.cassette.replay)
+
+    @property
+    def reads_local_files(self):
+        """
+        True if a plain file may be read instead of running a command:
+        the commands run on this Mac, and no cassette has to record or replay them.
+        """
+        return self.transport.local and not self.cassette
+
+    def set_deadline(self, seconds: float):
+        """
+        Limit the whole run: any command still running by then is killed and the run aborted.
+        """
+        self.deadline = time.monotonic() + seconds
+
+    def _time_left(self, timeout: Optional[float], default: bool):
+        """
+        :return: seconds a command may run: its own timeout or the default one, cut by the run deadline
+        """
+        if timeout is None and default:
+            timeout = self.timeout
+        if self.deadline is not None:
+            left = self.deadline - time.monotonic()
+            if left <= 0:
+                self.app.abort('Run deadline exceeded')
+            timeout = left if timeout is None else min(timeout, left)
+        return timeout
+
+    def _run(self, cmd: Union[str, list], stdout=None, stderr=None, input: bytes = None, shell=False,
+             timeout: float = None, terminal=False, on_line=None):
+        """
+        The only place where processes are started.
+        :param timeout: seconds; `self.timeout` by default unless `terminal`; the run deadline applies anyway
+        :param terminal: the command may prompt on the terminal, like sudo; otherwise it's started
+            in a session of its own, so a timeout kills its children too
+        :param on_line: called with every stdout line as soon as it's printed; stdout isn't returned then
+        :return: (exit code, stdout bytes, stderr bytes); outputs are empty unless piped
+        """
+        if self.replaying:
+            rc, out, err = self.cassette.play(cmd, input)
+            if on_line:
+                for line in out.splitlines():
+                    on_line(line)
+                out = b''
+            return rc, out, err
+        timeout = self._time_left(timeout, default=not terminal)
+        started = time.monotonic()
+        stdin = subprocess.PIPE if input is not None else None
+        if on_line:
+            stdout = subprocess.PIPE
+        p = self.transport.popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr, shell=shell,
+                                 start_new_session=not terminal)
+        try:
+            if on_line:
+                assert input is None
+                out, err = self._stream(p, on_line, timeout)
+            else:
+                out, err = p.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self._kill(p, group=not terminal)
+            cmd_str = cmd if isinstance(cmd, str) else shlex.join(cmd)
+            self.app.abort(f'Shell command timed out after {timeout:.1f} sec: {cmd_str}')
+        except BaseException:
+            self._kill(p, group=not terminal)  # like Ctrl+C: children of other sessions don't get it
+            raise
+        if self.cassette:
+            self.cassette.record(cmd, input, p.returncode, out, err, time.monotonic() - started)
+        return p.returncode, (b'' if on_line else out) or b'', err or b''
+
+    def _stream(self, p: subprocess.Popen, on_line, timeout: Optional[float]):
+        """
+        Pass stdout to `on_line` while the process runs.
+        :return: (stdout, stderr) like `communicate` does; stdout is kept only for a cassette
+        """
+        lines = [] if self.cassette else None
+        stop = threading.Event()
+
+        def emit(line: bytes):
+            on_line(line)
+            if lines is not None:
+                lines.append(line)
 
-    def exec_and_capture(self, cmd: list, check=True, shell=False, charset='utf-8', stderr=subprocess.PIPE, log=False):
+        def pump():
+            # raw reads polled by select, so the reader can be stopped and the pipe closed under it
+            fd = p.stdout.fileno()
+            pending = b''
+            while not stop.is_set():
+                if not select.select([fd], [], [], 0.1)[0]:
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                *complete, pending = (pending + chunk).split(b'\n')
+                for line in complete:
+                    emit(line + b'\n')
+            if pending:
+                emit(pending)
+
+        # a copy of the context keeps log prefixes, like the host of a fleet run
+        reader = threading.Thread(target=contextvars.copy_context().run, args=(pump,), daemon=True)
+        reader.start()
+        try:
+            p.wait(timeout)
+            # a background child may keep the pipe open; don't wait for it
+            reader.join(1.0)
+        finally:
+            stop.set()
+            reader.join()
+            p.stdout.close()
+        err = p.stderr.read() if p.stderr else b''
+        return b''.join(lines or []), err
+
+    @staticmethod
+    def _kill(p: subprocess.Popen, group: bool):
+        try:
+            if group:
+                os.killpg(p.pid, signal.SIGKILL)
+            else:
+                p.kill()
+        except ProcessLookupError:
+            pass
+        p.wait()
+
+    def exec_and_capture(self, cmd: list, check=True, shell=False, charset='utf-8', stderr=subprocess.PIPE, log=False,
+                         input: str = None, timeout: float = None):
+        """
+        Run a command and return its exit code and stripped stdout.
+        :param input: text to be fed to stdin
+        :param timeout: seconds, `self.timeout` by default
+        """
         cmd_str = shlex.join(cmd)
         if log:
             logging.info(f'EXEC: {cmd_str}')
-        p = subprocess.Popen(cmd, stderr=stderr, stdout=subprocess.PIPE, shell=shell)
-        stdout, stderr = p.communicate()
-        if check and p.returncode != 0:
-            self.app.abort(f'Shell command failed: {cmd_str} - exit code {p.returncode}')
-        return p.returncode, stdout.decode(charset).strip()
+        input_bytes = input.encode(charset) if input is not None else None
+        cache_key = (tuple(cmd), shell, stderr, input_bytes)
+        if self.app.audit.enabled and cache_key in self._probe_cache:
+            rc, stdout, err = self._probe_cache[cache_key]
+        else:
+            rc, stdout, err = self._run(cmd, stdout=subprocess.PIPE, stderr=stderr, input=input_bytes, shell=shell,
+                                        timeout=timeout)
+            if self.app.audit.enabled:
+                with self._probe_cache_lock:
+                    self._probe_cache[cache_key] = rc, stdout, err
+        if check and rc != 0:
+            self.app.abort(f'Shell command failed: {cmd_str} - exit code {rc}'
+                           + _tail(err.decode(charset, 'replace').splitlines(), self.TAIL_LINES))
+        return rc, stdout.decode(charset).strip()
 
-    def exec_interactive(self, cmd: Union[str, list], check=True, stdout=None, stderr=None, log=True):
+    def exec_interactive(self, cmd: Union[str, list], check=True, stdout=None, stderr=None, log=True,
+                         timeout: float = None):
+        """
+        Run a command attached to the terminal, so it may prompt a user, like `chsh` does.
+        No default timeout: a user may be typing a password.
+        """
         if isinstance(cmd, list):
             cmd_str = shlex.join(cmd)
             cmd_list = cmd
@@ -32,57 +197,197 @@ class Exec:
             cmd_list = shlex.split(cmd)
         else:
             raise Exception('should not happen')
+        if self.app.audit.skip(cmd_str):
+            return 0
+        if log:
+            logging.info(f'Exec: {cmd_str}')
+        rc, _, _ = self._run(cmd_list, stdout=stdout, stderr=stderr, timeout=timeout, terminal=True)
+        if check and rc != 0:
+            self.app.abort(f'Shell command failed: {cmd_str} - exit code {rc}')
+        return rc
+
+    def exec(self, cmd: Union[str, list], check=True, log=True, timeout: float = None, charset='utf-8'):
+        """
+        Run a command, its output goes to the log line by line.
+        Only the last lines are kept, to explain a failure, so a chatty command costs no memory.
+        :param timeout: seconds, `self.timeout` by default
+        """
+        if isinstance(cmd, str):
+            cmd = shlex.split(cmd)
+        cmd_str = shlex.join(cmd)
+        if self.app.audit.skip(cmd_str):
+            return 0
         if log:
             logging.info(f'Exec: {cmd_str}')
-        p = subprocess.Popen(cmd_list, stdout=stdout, stderr=stderr)
-        stdout, stderr = p.communicate()
-        if check and p.returncode != 0:
-            self.app.abort(f'Shell command failed: {cmd_str} - exit code {p.returncode}')
-        return p.returncode
+        tail = collections.deque(maxlen=self.TAIL_LINES)
+
+        def on_line(line: bytes):
+            line = line.decode(charset, 'replace').rstrip()
+            tail.append(line)
+            if log:
+                logging.info(f'  | {line}')
 
-    def exec(self, cmd: Union[str, list], check=True, log=True):
-        return self.exec_interactive(cmd, check=check, log=log)
+        rc, _, _ = self._run(cmd, stderr=subprocess.STDOUT, timeout=timeout, on_line=on_line)
+        if check and rc != 0:
+            self.app.abort(f'Shell command failed: {cmd_str} - exit code {rc}' + _tail(tail, self.TAIL_LINES))
+        return rc
+
+    def native(self, cmd: list, func, *args, log=True, probe=False, parse=None, **kwargs):
+        """
+        Do the job of a shell command by a direct syscall, like `os.symlink` instead of `ln -s`.
+        Logged and reported the same way as the command itself would be.
+        Syscalls reach the local machine only, and a cassette can't record them,
+        so with a remote transport or a cassette the command itself is run.
+        :param cmd: the equivalent command
+        :param probe: True for read-only calls, they run in audit mode too
+        :param parse: turns the command's output into what `func` would return; required for remote probes
+        :return: whatever `func` returns; None if skipped in audit mode or a remote non-probe
+        """
+        cmd_str = shlex.join(cmd)
+        if not probe and self.app.audit.skip(cmd_str, kind='native'):
+            return None
+        if not self.reads_local_files:
+            if probe:
+                assert parse, f'No way to run remotely: {cmd_str}'
+                rc, out = self.exec_and_capture(cmd, log=log)
+                return parse(out)
+            self.exec(cmd, log=log)
+            return None
+        if log:
+            logging.info(f'Exec: {cmd_str}')
+        try:
+            return func(*args, **kwargs)
+        except OSError as e:
+            self.app.abort(f'Shell command failed: {cmd_str} - {e}')
 
-    def sudo(self, cmd: Union[str, list], check=True, charset='utf-8'):
+    def test(self, flag: str, path: str):
+        """
+        Like `test -e path`, on the Mac being configured: by a syscall if it's this one, by the command otherwise.
+        :param flag: '-e' exists, '-d' is a folder, '-w' is a folder new files can be created in
+        """
+        if self.reads_local_files:
+            return {
+                '-e': os.path.exists,
+                '-d': os.path.isdir,
+                '-w': lambda path: os.access(path, os.W_OK | os.X_OK),
+            }[flag](path)
+        rc, _ = self.exec_and_capture(['test', flag, path], check=False)
+        return rc == 0
+
+    @contextlib.contextmanager
+    def sudo_batch(self):
+        """
+        Collect `sudo` calls made inside the block and run them by a single sudo at the end of it,
+        so a user is bothered once. Such calls return an empty output.
+        """
+        outer = getattr(self._sudo_batch, 'cmds', None)
+        if outer is not None:
+            yield  # nested: the outer batch runs everything
+            return
+        self._sudo_batch.cmds = []
+        try:
+            yield
+            cmds = self._sudo_batch.cmds
+        finally:
+            self._sudo_batch.cmds = None
+        if len(cmds) == 1:
+            self.sudo(cmds[0])
+        elif cmds:
+            self.sudo_temp_file(['set -e'] + [shlex.join(cmd) for cmd in cmds])
+
+    def sudo(self, cmd: Union[str, list], check=True, charset='utf-8', timeout: float = None):
         if isinstance(cmd, str):
             cmd = shlex.split(cmd)
         cmd_list = ['sudo', '-S', '--'] + cmd
         cmd_str = shlex.join(cmd_list)
+        if self.app.audit.skip(shlex.join(cmd), kind='sudo'):
+            return ''
+        if getattr(self._sudo_batch, 'cmds', None) is not None:
+            self._sudo_batch.cmds.append(cmd)
+            return ''
         logging.info(f'Exec: {cmd_str}')
-        p = subprocess.Popen(cmd_list, stdout=subprocess.PIPE)
-        stdout, stderr = p.communicate()
-        if p.returncode != 0 and check:
-            self.app.abort(f'Last command exited with code {p.returncode}')
+        rc, stdout, _ = self._run(cmd_list, stdout=subprocess.PIPE, timeout=timeout, terminal=True)
+        if rc != 0 and check:
+            self.app.abort(f'Last command exited with code {rc}')
         return stdout.decode(charset).rstrip()
 
     def exec_script_file(self, shell_script_file, shell='bash'):
         shell_script_file = self.app.resolve_file(shell_script_file)
-        self.exec([shell, str(shell_script_file)])
+        self.exec_interactive([shell, str(shell_script_file)])
 
     def sudo_temp_file(self, content: list, executor='bash'):
         assert executor
         assert content
-        script_file = tempfile.mktemp('.sh')
-        text = '\n'.join(content)
-        Path(script_file).write_text(text)
-        self.sudo([executor, script_file])
+        if self.app.audit.skip('; '.join(content), kind='sudo'):
+            return
+        self.sudo(self._script_cmd(executor, content))
 
     def exec_temp_file(self, content: list, executor='bash', check=True, log=True):
         assert executor
         assert content
-        script_file = tempfile.mktemp('.sh')
-        text = '\n'.join(content)
+        if self.app.audit.skip('; '.join(content)):
+            return 0
         if log:
             for line in content:
                 logging.info(f'EXEC LINE: {line}')
-        Path(script_file).write_text(text)
-        return self.exec([executor, script_file], check=check, log=log)
+        # scripts may prompt, like the brew installer asking for a password
+        return self.exec_interactive(self._script_cmd(executor, content), check=check, log=log)
+
+    def _script_cmd(self, executor: str, content: list):
+        """
+        A command running script lines: from a temp file on this machine;
+        inline otherwise, as a local file is missing on a remote Mac and unreadable by another user.
+        The script isn't fed to stdin, which stays free for sudo and installer prompts.
+        """
+        if self.transport.local:
+            return [executor, self._write_temp_script(content)]
+        return [executor, '-c', '\n'.join(content)]
+
+    @staticmethod
+    def _write_temp_script(content: list):
+        # unlike `mktemp`, nobody can put a file of their own at the name between choosing and writing it
+        fd, script_file = tempfile.mkstemp('.sh')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(content))
+        return script_file
 
-    def exec_osa_script(self, text: str, check=True, log=True):
+    def exec_osa_script(self, text: str, check=True, log=True, probe=False, args: list = (), timeout: float = None):
+        """
+        Run an AppleScript; it's compiled once and cached, see `osa.compile_cached`.
+        With a remote transport the source is sent to stdin instead, as the cache is local.
+        :param probe: True for read-only scripts, they run in audit mode too
+        :param args: passed to the script's `on run argv` handler; better than formatting them into the text,
+            as no quoting needed and the compiled script is reused
+        :param timeout: seconds, `self.timeout` by default; a script may hang on a permission dialog
+        """
         assert text
-        script_file = tempfile.mktemp('.sh')
+        args = [str(arg) for arg in args]
+        if not probe and self.app.audit.skip(shlex.join([text] + args), kind='osascript'):
+            return 0, ''
         if log:
-            logging.info(f'EXEC OSA SCRIPT: {text}')
-        Path(script_file).write_text(text)
-        return self.exec_and_capture(['osascript', script_file], check=check, log=log)
+            logging.info(f'EXEC OSA SCRIPT: {text}' + (f' ARGS: {shlex.join(args)}' if args else ''))
+        if not self.transport.local:
+            return self.exec_and_capture(['osascript', '-'] + args, check=check, log=log, input=text,
+                                         timeout=timeout)
+        # a cassette keeps the source in the command line, so it's replayable anywhere
+        script_file = None if self.cassette else compile_cached(self, text)
+        if script_file:
+            cmd = ['osascript', script_file]
+        else:
+            cmd = ['osascript'] + [arg for line in text.splitlines() for arg in ('-e', line)]
+        return self.exec_and_capture(cmd + args, check=check, log=log, timeout=timeout)
+
+    def osa_batch(self, probe=True):
+        """
+        Start gathering AppleScript queries to be run by a single `osascript`, see `OsaBatch`.
+        :param probe: True for read-only queries, they run in audit mode too
+        """
+        return OsaBatch(self, probe=probe)
+
 
+def _tail(lines, limit: int):
+    """
+    Format the last output lines for an error message.
+    """
+    lines = list(lines)[-limit:]
+    return ''.join(f'\n  | {line}' for line in lines)
@@ -0,0 +1,58 @@
+import threading
+import time
+from typing import Optional
+
+
+class Facts:
+    """
+    System facts probed once per run, like the timezone or the login shell.
+    A fact is remembered by its name and arguments; a write made by automac updates it,
+    so a later check reads what was written without probing again.
+
+    A TTL makes a fact expire, which matters for a long-running `AutoMac.enforce`.
+    """
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self._values = {}  # (name, args) -> (value, expiry time or None)
+        self._lock = threading.Lock()
+
+    def get(self, name: str, probe, *args, ttl: Optional[float] = None):
+        """
+        :param probe: called with `args` when the fact is unknown or expired
+        :param ttl: seconds the fact is valid for; forever if None
+        """
+        key = (name, args)
+        with self._lock:
+            if key in self._values:
+                value, expires = self._values[key]
+                if expires is None or time.monotonic() < expires:
+                    return value
+        value = probe(*args)
+        with self._lock:
+            self._values[key] = value, (time.monotonic() + ttl if ttl is not None else None)
+        return value
+
+    def wrote(self, name: str, *args, value, ttl: Optional[float] = None):
+        """
+        Remember a value just written; nothing is written in audit mode, so nothing changes then.
+        """
+        if self.app.audit.enabled:
+            return
+        with self._lock:
+            self._values[(name, args)] = value, (time.monotonic() + ttl if ttl is not None else None)
+
+    def invalidate(self, name: str, *args):
+        """
+        Forget a fact; all facts of the name if no `args`.
+        """
+        with self._lock:
+            for key in list(self._values):
+                if key[0] == name and (not args or key[1] == args):
+                    del self._values[key]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
@@ -8,13 +8,22 @@ class FileAssoc:
         self.app = app
 
     def extensions(self, app_name: str, role: str, extensions: list[str]):
-        # todo check duti installed
-        # todo resolve path to duti in runtime
+        self.extensions_many([(app_name, role, extensions)])
+
+    def extensions_many(self, assignments: list):
+        """
+        :param assignments: like [('IINA', 'viewer', ['mkv', 'mp4']), ('Sublime Text', 'editor', ['txt'])];
+            the apps are resolved at once
+        """
+        bundle_ids = self.app.get_app_bundle_ids(*(app_name for app_name, _, _ in assignments))
+        for app_name, role, extensions in assignments:
+            self._assign(bundle_ids[app_name], role, extensions)
+
+    def _assign(self, bundle_id: str, role: str, extensions: list[str]):
         assert role in {'none', 'viewer', 'editor', 'all'}
         extensions = map(str.strip, extensions)
         extensions = filter(bool, extensions)
         extensions = list(extensions)
-        bundle_id = self.app.get_app_bundle_id(app_name)
         for ext in extensions:
             ext_orig = ext
             ext = ext[1:] if ext.startswith('.') else ext
@@ -24,8 +33,9 @@ class FileAssoc:
             bundle_id_before = self._get_current_bundle_by_ext(ext)
             if bundle_id != bundle_id_before:
                 # logging.debug(f'Change handler for {ext}: {cur_bundle} -> {bundle_id}')
-                cmd = ['/opt/homebrew/bin/duti', '-s', bundle_id, f'.{ext}', role]
-                self.app.exec.exec(cmd)
+                self.app.backends.launch_services.set_handler(bundle_id, ext, role)
+                if self.app.audit.enabled:
+                    continue
                 bundle_id_after = self._get_current_bundle_by_ext(ext)
                 if bundle_id_before == bundle_id_after:
                     logging.warning(
@@ -33,12 +43,4 @@ class FileAssoc:
                         'Probably you want a stronger role: `editor` or `all`')
 
     def _get_current_bundle_by_ext(self, ext):
-        rc, cur_settings = self.app.exec.exec_and_capture(['/opt/homebrew/bin/duti', '-x', ext], check=False)
-        # Example of `duti -x txt` output:
-        #   TextEdit.app
-        #   /System/Applications/TextEdit.app
-        #   com.apple.TextEdit
-        lines = cur_settings.splitlines()
-        if rc != 0 or len(lines) < 3:
-            return ''
-        return lines[2]  # like 'com.apple.TextEdit'
+        return self.app.backends.launch_services.get_handler(ext)
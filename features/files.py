@@ -1,6 +1,20 @@
+import hashlib
+import json
+import logging
 import os
+import shlex
+import shutil
 import stat
+import string
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable, Optional, Union
+
+import util
+
+# folders of the links made by `link_tree`, per source and destination; they are checked by a later prune
+LINK_TREE_STATE_DIR = '~/Library/Caches/automac/link_tree'
 
 
 class Files:
@@ -8,12 +22,14 @@ class Files:
         from automac import AutoMac
         app: AutoMac = app
         self.app = app
+        self._template_variables = None  # populated on demand
 
     def link(self, master_file: str, alias: str):
         # print(f'link_forced: {alias} -> {master_file}')
-        master_file = os.path.expanduser(master_file)
-        alias = os.path.expanduser(alias)
+        master_file = self.app.expand_user(master_file)
+        alias = self.app.expand_user(alias)
         assert os.path.exists(master_file), f'Missing master_file: {master_file}'
+        self.app.watcher.track([alias], self.link, master_file, alias)
         if os.path.lexists(alias):
             if os.path.islink(alias):
                 current_target = os.readlink(alias)
@@ -27,18 +43,321 @@ class Files:
             else:
                 self.remove(alias)
         self.mkdir(str(Path(alias).parent))
-        self.app.exec.exec(['ln', '-s', master_file, alias])
+        self._symlink(master_file, alias)
+
+    def _symlink(self, master_file: str, alias: str):
+        cmd = ['ln', '-s', master_file, alias]
+        if self._writable(self._nearest_existing_parent(alias)):
+            self.app.exec.native(cmd, os.symlink, master_file, alias)
+        else:
+            self.app.exec.sudo(cmd)
+
+    def link_tree(self, src_dir: str, dst_dir: str, rules: Union[dict, Callable, None] = None, prune=False):
+        """
+        Mirror files of `src_dir` into `dst_dir` as symbolic links, like a bulk `link`.
+        The source is walked once; only missing or wrong links are changed.
+        :param src_dir: like '~/Dropbox/config/dotfiles'
+        :param dst_dir: like '~'
+        :param rules: how a source file, relative to `src_dir`, is named in `dst_dir`:
+            a dict like {'bashrc.sh': '.bashrc'} (unlisted files are skipped)
+            or a callable returning a relative name or None to skip;
+            by default every file keeps its relative path
+        :param prune: remove links that point into `src_dir` but are not wanted anymore,
+            also in folders the previous run linked into, like those of a removed source folder
+        :return: a number of changes made
+        """
+        src_dir = os.path.abspath(self.app.expand_user(src_dir))
+        dst_dir = os.path.abspath(self.app.expand_user(dst_dir))
+        assert os.path.isdir(src_dir), f'Missing src_dir: {src_dir}'
+        if rules is None:
+            rules = lambda rel_path: rel_path
+        elif isinstance(rules, dict):
+            rules = rules.get
+        desired = {}  # link path -> master file
+        for rel_path, src_path in self._scan_files(src_dir):
+            dst_rel_path = rules(rel_path)
+            if dst_rel_path:
+                desired[os.path.join(dst_dir, self.app.expand_user(dst_rel_path))] = src_path
+        self.app.watcher.track(list(desired), self.link_tree, src_dir, dst_dir, rules, prune=prune)
+        alias_dirs = {os.path.dirname(alias) for alias in desired}
+        state_file = os.path.join(self.app.expand_user(LINK_TREE_STATE_DIR),
+                                  hashlib.sha256(f'{src_dir}\0{dst_dir}'.encode('utf-8')).hexdigest() + '.json')
+
+        to_create = []
+        for alias, master_file in desired.items():
+            try:
+                st = os.lstat(alias)
+            except FileNotFoundError:
+                to_create.append((alias, master_file))
+                continue
+            if stat.S_ISLNK(st.st_mode):
+                target = os.readlink(alias)
+                if target == master_file or (os.path.exists(alias) and os.path.samefile(alias, master_file)):
+                    continue
+            elif stat.S_ISDIR(st.st_mode):
+                self.app.abort(f'Link cannot replace an existing directory: {alias}')
+            to_create.append((alias, master_file))
+
+        to_prune = []
+        if prune:
+            for alias_dir in sorted(alias_dirs | set(self._read_json(state_file, []))):
+                to_prune.extend(self._find_stale_links(alias_dir, src_dir, desired))
+
+        for alias in to_prune:
+            self.remove(alias)
+        created_dirs = set()
+        for alias, master_file in to_create:
+            if os.path.lexists(alias):
+                self.remove(alias)
+            alias_dir = os.path.dirname(alias)
+            if alias_dir not in created_dirs:
+                created_dirs.add(self.mkdir(alias_dir))
+            self._symlink(master_file, alias)
+        if not self.app.audit.enabled:
+            self._write_json(state_file, sorted(alias_dirs))
+        logging.debug(f'link_tree {src_dir} -> {dst_dir}: {len(desired)} links, '
+                      f'{len(to_create)} created, {len(to_prune)} pruned')
+        return len(to_create) + len(to_prune)
+
+    @staticmethod
+    def _read_json(path: str, default):
+        try:
+            with open(path, encoding='utf-8') as fd:
+                return json.load(fd)
+        except (OSError, ValueError):
+            return default
+
+    @staticmethod
+    def _write_json(path: str, value):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(prefix='.state.', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(value, f)
+            os.replace(temp_file, path)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    @staticmethod
+    def _scan_files(root: str):
+        """
+        Yield (relative path, absolute path) of every non-directory under `root`.
+        """
+        stack = [root]
+        while stack:
+            cur_dir = stack.pop()
+            with os.scandir(cur_dir) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        yield os.path.relpath(entry.path, root), entry.path
+
+    @staticmethod
+    def _find_stale_links(alias_dir: str, src_dir: str, desired: dict):
+        if not os.path.isdir(alias_dir):
+            return []
+        stale = []
+        src_prefix = src_dir + os.sep
+        with os.scandir(alias_dir) as it:
+            for entry in it:
+                if entry.is_symlink() and entry.path not in desired:
+                    target = os.readlink(entry.path)
+                    if target.startswith(src_prefix):
+                        stale.append(entry.path)
+        return stale
+
+    def copy(self, master_file: str, target: str, render=False, variables: dict = None):
+        """
+        A copying alternative to `link` for targets that cannot be symbolic links,
+        like files read by sandboxed apps or files under `/etc`.
+        See `copy_all`.
+        :return: True if the target was written
+        """
+        return self.copy_all({master_file: target}, render=render, variables=variables) > 0
+
+    def copy_all(self, files: dict, render=False, variables: dict = None, max_workers=1):
+        """
+        Copy files to their targets, writing only those whose content differs.
+        Unchanged targets are recognized by size and mtime first, then by a content hash.
+        Every target is replaced atomically; targets in non-writable folders are written by one sudo call.
+        :param files: like {'~/Dropbox/config/hosts': '/etc/hosts'}
+        :param render: treat files as templates with `$name` placeholders, see `template_variables`
+        :param variables: additional template variables
+        :param max_workers: targets in writable folders copied at the same time
+        :return: a number of written targets
+        """
+        self.app.watcher.track(list(map(self.app.expand_user, files.values())), self.copy_all, files,
+                               render=render, variables=variables, max_workers=max_workers)
+        if render:
+            variables = {**self.template_variables(), **(variables or {})}
+        written = []
+        local = []  # (master file, content, target)
+        privileged = []  # (temp file, target)
+        for master_file, target in files.items():
+            master_file = self.app.expand_user(master_file)
+            target = self.app.expand_user(target)
+            assert os.path.isfile(master_file), f'Missing master_file: {master_file}'
+            content = self._render(master_file, variables) if render else None
+            if self._up_to_date(master_file, content, target):
+                continue
+            target_dir = self.mkdir(os.path.dirname(target))
+            if not self.app.exec.transport.local:
+                # `cp` would run as another user or on another Mac, where the master file may be out of reach
+                self._write_by_transport(master_file, content, target)
+            elif self._writable(target_dir):
+                local.append((master_file, content, target))
+            else:
+                temp_fd, temp_file = tempfile.mkstemp(prefix='automac-')
+                os.close(temp_fd)
+                self._write_content(master_file, content, temp_file)
+                privileged.append((temp_file, target))
+            written.append(target)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            list(pool.map(lambda item: self._copy_local(*item), local))
+        if privileged:
+            self._sudo_replace_all(privileged)
+        logging.debug(f'Files copied: {len(written)} of {len(files)}')
+        return len(written)
+
+    def template_variables(self):
+        """
+        Per-machine variables available in templates:
+        `$serial`, `$vm` ('1' or '0'), `$os_version` like '14.7.1', `$login`.
+        """
+        if self._template_variables is None:
+            self._template_variables = {
+                'serial': self.app.get_machine_serial(),
+                'vm': '1' if self.app.is_virtual_machine() else '0',
+                'os_version': self.app.get_mac_version_str(),
+                'login': self.app.login,
+            }
+        return self._template_variables
+
+    @staticmethod
+    def _render(master_file: str, variables: dict):
+        text = Path(master_file).read_text(encoding='utf-8')
+        # `safe_substitute` keeps shell variables like $HOME untouched
+        return string.Template(text).safe_substitute(variables).encode('utf-8')
+
+    def _up_to_date(self, master_file: str, content: Optional[bytes], target: str):
+        if not self.app.exec.reads_local_files:
+            # the target is out of reach of syscalls, so it's hashed where it is
+            rc, out = self.app.exec.exec_and_capture(['shasum', '-a', '256', target], check=False)
+            digest = hashlib.sha256(content).hexdigest() if content is not None else util.hash_file(master_file)
+            return rc == 0 and out.split()[:1] == [digest]
+        if content is not None:
+            return self._same_content(content, target)
+        return self._same_file(master_file, target)
+
+    @staticmethod
+    def _same_content(content: bytes, target: str):
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            return False
+        if st.st_size != len(content):
+            return False
+        return util.hash_file(target) == hashlib.sha256(content).hexdigest()
+
+    def _same_file(self, master_file: str, target: str):
+        try:
+            st_target = os.stat(target)
+        except FileNotFoundError:
+            return False
+        st_master = os.stat(master_file)
+        if st_target.st_size != st_master.st_size:
+            return False
+        if st_target.st_mtime_ns == st_master.st_mtime_ns:
+            return True  # `_write_content` copies mtime, so it's a previously synced file
+        if util.hash_file(target) != util.hash_file(master_file):
+            return False
+        if not self.app.audit.enabled and st_target.st_uid == os.geteuid():
+            # the same content: take the master's mtime, so the next run doesn't hash the files again
+            os.utime(target, ns=(st_target.st_atime_ns, st_master.st_mtime_ns))
+        return True
+
+    def _copy_local(self, master_file: str, content: Optional[bytes], target: str):
+        self.app.exec.native(['cp', master_file, target], self._write_atomic, master_file, content, target)
+
+    def _write_atomic(self, master_file: str, content: Optional[bytes], target: str):
+        temp_fd, temp_file = tempfile.mkstemp(prefix=f'.{os.path.basename(target)}.', dir=os.path.dirname(target))
+        os.close(temp_fd)
+        try:
+            self._write_content(master_file, content, temp_file)
+            if os.path.exists(target):
+                shutil.copymode(target, temp_file)
+            elif content is not None:
+                os.chmod(temp_file, 0o644)  # mkstemp creates private files
+            os.replace(temp_file, target)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _write_by_transport(self, master_file: str, content: Optional[bytes], target: str):
+        sudo = not self._writable(os.path.dirname(target))
+        if self.app.audit.skip(shlex.join(['cp', master_file, target]), kind='sudo' if sudo else 'exec'):
+            return
+        # the file is written aside, then moved over the target at once; `cp -p` keeps the target's mode
+        script = 'set -e; new="$1.automac-new"; [ ! -e "$1" ] || cp -p "$1" "$new"; cat > "$new"; mv -f "$new" "$1"'
+        cmd = ['sh', '-c', script, 'sh', target]
+        if sudo:
+            cmd = ['sudo', '-n', '--'] + cmd  # stdin is taken by the content, so sudo mustn't ask for a password
+        data = content if content is not None else Path(master_file).read_bytes()
+        # latin-1 maps every byte to a char and back, so binary files pass unchanged
+        self.app.exec.exec_and_capture(cmd, input=data.decode('latin-1'), charset='latin-1', log=True)
+
+    @staticmethod
+    def _write_content(master_file: str, content: Optional[bytes], path: str):
+        if content is None:
+            shutil.copyfile(master_file, path)  # streamed, not loaded into memory
+            shutil.copystat(master_file, path)
+        else:
+            Path(path).write_bytes(content)
+
+    def _sudo_replace_all(self, files: list):
+        lines = ['set -e']
+        for temp_file, target in files:
+            new_file = f'{target}.automac-new'
+            # -p keeps the master's mtime for `_same_file`; the owner and mode are those of the target
+            lines.append(f'cp -p {shlex.quote(temp_file)} {shlex.quote(new_file)}')
+            st = os.stat(target) if os.path.exists(target) else None
+            uid, gid, mode = (st.st_uid, st.st_gid, stat.S_IMODE(st.st_mode)) if st else (0, 0, 0o644)
+            lines.append(f'chown {uid}:{gid} {shlex.quote(new_file)}')
+            lines.append(f'chmod {mode:o} {shlex.quote(new_file)}')
+            lines.append(f'mv -f {shlex.quote(new_file)} {shlex.quote(target)}')
+        try:
+            self.app.exec.sudo_temp_file(lines)
+        finally:
+            for temp_file, _ in files:
+                os.remove(temp_file)
 
     def remove(self, path):
+        if self.app.audit.skip(f'rm {path}', kind='native'):
+            return
         print(f'Removing {path}')
         os.remove(str(path))
 
     def mkdir(self, path: str):
-        path = os.path.expanduser(path)
-        if not os.path.exists(path):
-            self.app.exec.exec(['mkdir', '-p', path])
+        path = self.app.expand_user(path)
+        if not self.app.exec.test('-e', path):
+            cmd = ['mkdir', '-p', path]
+            if self._writable(self._nearest_existing_parent(path)):
+                self.app.exec.native(cmd, os.makedirs, path, exist_ok=True)
+            else:
+                self.app.exec.sudo(cmd)
         return path
 
+    def _nearest_existing_parent(self, path: str):
+        parent = os.path.dirname(os.path.abspath(path))
+        while not self.app.exec.test('-e', parent):
+            parent = os.path.dirname(parent)
+        return parent
+
+    def _writable(self, dir_path: str):
+        return self.app.exec.test('-w', dir_path)
+
     def mkdirs(self, *paths):
         for path in paths:
             self.mkdir(path)
@@ -48,9 +367,13 @@ class Files:
             self._unset_hidden_flag_one(path)
 
     def _unset_hidden_flag_one(self, path: str):
-        path = os.path.expanduser(path)
+        path = self.app.expand_user(path)
         res = os.lstat(path)
         hidden = (res.st_flags & stat.UF_HIDDEN) != 0  # UF_HIDDEN is macos-specific
         if hidden:
-            # todo no sudo needed for home folders
-            self.app.exec.sudo(['chflags', 'nohidden', path])
+            cmd = ['chflags', 'nohidden', path]
+            if res.st_uid == os.geteuid():
+                # owner may change user flags, no sudo needed for home folders
+                self.app.exec.native(cmd, os.chflags, path, res.st_flags & ~stat.UF_HIDDEN, follow_symlinks=False)
+            else:
+                self.app.exec.sudo(cmd)
@@ -0,0 +1,136 @@
+import contextvars
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from features.backends import Backends, SimulatedMac
+from features.cassette import Cassette
+from features.transport import LocalTransport, SshTransport, Transport, UserTransport
+
+
+class Fleet:
+    """
+    Applies one config to many Macs at once, from a single control host.
+    Every host gets an `AutoMac` of its own; their commands go over the host's transport.
+
+    Usage:
+        def config(mac: AutoMac):
+            mac.dock_...
+
+        fleet = Fleet(max_workers=8)
+        fleet.add_ssh('admin@mini1.local')
+        fleet.add_ssh('admin@mini2.local')
+        report = fleet.run(config)
+
+    Settings and apps work remotely; file features (`link`, `copy`, `mkdir`, ...) operate on local paths,
+    so they are for the control host only.
+    """
+
+    def __init__(self, max_workers=8, audit: bool = None):
+        """
+        :param max_workers: hosts configured at the same time
+        :param audit: see `AutoMac`
+        """
+        self.max_workers = max_workers
+        self.audit = audit
+        self.hosts = {}  # name -> (transport, backends)
+
+    def add(self, transport: Transport, backends: Backends = None):
+        assert transport.name not in self.hosts, transport.name
+        self.hosts[transport.name] = (transport, backends)
+        return self
+
+    def add_ssh(self, host: str, **kwargs):
+        """
+        :param kwargs: see `SshTransport`
+        """
+        return self.add(SshTransport(host, **kwargs))
+
+    def add_users(self, *logins: str):
+        """
+        Add accounts of this machine, for the user-level part of a config; see `UserTransport`.
+        """
+        for login in logins:
+            self.add(UserTransport(login))
+        return self
+
+    def add_simulated(self, count: int, root_dir: str = None):
+        """
+        Add hosts living on this machine, to try a config or measure a fleet run on Linux.
+        Their settings are kept in memory (`SimulatedMac`); other commands run as local processes,
+        each host with a home folder of its own.
+        """
+        root_dir = root_dir or tempfile.mkdtemp(prefix='automac-fleet-')
+        for i in range(1, count + 1):
+            name = f'sim{i:03d}'
+            home = os.path.join(root_dir, name)
+            os.makedirs(home, exist_ok=True)
+            self.add(LocalTransport(name, env={'HOME': home}, cwd=home), SimulatedMac(serial=f'SIM{i:05d}'))
+        return self
+
+    def run(self, config):
+        """
+        :param config: a function taking an `AutoMac`
+        :return: like {'success': False, 'drift': False, 'failed': ['mini2'], 'hosts': {'mini1': {...}, ...}};
+            a host's report is that of `Audit.report` plus its error
+        """
+        started = time.monotonic()
+        log_filter = _HostLogFilter()
+        logging.getLogger().addFilter(log_filter)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {name: pool.submit(self._run_host, name, transport, backends, config)
+                           for name, (transport, backends) in self.hosts.items()}
+                reports = {name: future.result() for name, future in futures.items()}
+        finally:
+            logging.getLogger().removeFilter(log_filter)
+        failed = [name for name, report in reports.items() if not report['success']]
+        logging.info(f'Fleet: {len(reports) - len(failed)} of {len(reports)} hosts done '
+                     f'in {time.monotonic() - started:.1f} sec')
+        return {
+            'success': not failed,
+            'drift': any(report['drift'] for report in reports.values()),
+            'failed': failed,
+            'duration_sec': round(time.monotonic() - started, 3),
+            'hosts': reports,
+        }
+
+    def _run_host(self, name: str, transport: Transport, backends: Backends, config):
+        from automac import AutoMac
+        token = _HostLogFilter.host.set(name)
+        error = None
+        # a cassette file per host, as hosts run the same commands with different output
+        mac = AutoMac(audit=self.audit, backends=backends, transport=transport, cassette=Cassette.from_env(name))
+        try:
+            config(mac)
+            if mac.success:
+                mac.restarts.run()
+        except SystemExit:
+            pass  # `abort` has logged it already
+        except Exception as e:
+            mac.success = False
+            error = f'{type(e).__name__}: {e}'
+            logging.exception(f'Host failed: {error}')
+        finally:
+            transport.close()
+            _HostLogFilter.host.reset(token)
+        report = mac.audit.report()
+        report['error'] = error
+        return report
+
+
+class _HostLogFilter(logging.Filter):
+    """
+    Prefixes log messages with the host a worker thread is busy with.
+    A context variable rather than a thread-local, so threads started with a copy of the context,
+    like the output readers of `Exec`, log with the prefix too.
+    """
+    host = contextvars.ContextVar('automac_host', default=None)
+
+    def filter(self, record: logging.LogRecord):
+        name = self.host.get()
+        if name:
+            record.msg = f'[{name}] {record.msg}'
+        return True
@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import util
+
+INDEX_FILE = '~/Library/Caches/automac/fonts.json'
+EXTENSIONS = ('.ttf', '.otf', '.ttc', '.otc', '.dfont')
+USER_FONTS = '~/Library/Fonts'
+SYSTEM_FONTS = '/Library/Fonts'
+
+
+class Fonts:
+    """
+    Installs font files from a folder, by copying them into the fonts folder; macos picks them up by itself.
+    A font already installed is skipped, whatever its file name is: fonts are compared by a content hash.
+    Hashes are remembered between runs, a file is hashed again only if its size or mtime changed.
+
+    Usage:
+        mac.add_lookup_folder('~/Dropbox/config')
+        mac.fonts.install('fonts')  # every font beneath ~/Dropbox/config/fonts
+        mac.fonts.install('fonts-shared', system=True)  # into /Library/Fonts, by one sudo
+    """
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self._index = None  # path -> [size, mtime_ns, sha256]; loaded on demand
+        self._lock = threading.Lock()
+
+    def install(self, *folders: str, system=False, max_workers=8):
+        """
+        :param folders: absolute or relative to a lookup folder, see `AutoMac.add_lookup_folder`
+        :param system: install for all users, into /Library/Fonts
+        :param max_workers: files hashed and copied at the same time
+        :return: a number of fonts installed
+        """
+        started = time.monotonic()
+        fonts_dir = self.app.fs.mkdir(SYSTEM_FONTS if system else USER_FONTS)
+        sources = {}  # file name -> path
+        for folder in folders:
+            for path in list_fonts(str(self.app.resolve_file(self.app.expand_user(folder)))):
+                name = os.path.basename(path)
+                if name in sources:
+                    logging.warning(f'Font {name} found twice, skipping {path}')
+                    continue
+                sources[name] = path
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            installed_hashes = self._installed_hashes(fonts_dir, pool)
+            source_hashes = list(pool.map(self.file_hash, sources.values()))
+            missing = {}  # source -> target
+            for (name, source), digest in zip(sources.items(), source_hashes):
+                if digest in installed_hashes:
+                    continue
+                missing[source] = installed_hashes[digest] = os.path.join(fonts_dir, name)
+        if missing:
+            self.app.fs.copy_all(missing, max_workers=max_workers)
+        local = self.app.exec.reads_local_files
+        if local:
+            self._remember_copies(missing)
+        if not self.app.audit.enabled:
+            # installed fonts of another Mac are hashed over there, so the index keeps the sources only
+            installed = set(installed_hashes.values()) if local else set()
+            self.save_index(installed | set(sources.values()))
+        logging.info(f'Fonts: {len(missing)} of {len(sources)} installed into {fonts_dir} '
+                     f'in {time.monotonic() - started:.1f} sec')
+        return len(missing)
+
+    def file_hash(self, path: str):
+        """
+        SHA-256 of a file, from the index if the file's size and mtime are unchanged.
+        """
+        st = os.stat(path)
+        with self._lock:
+            entry = self.index().get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        digest = util.hash_file(path)
+        with self._lock:
+            self.index()[path] = [st.st_size, st.st_mtime_ns, digest]
+        return digest
+
+    def _installed_hashes(self, fonts_dir: str, pool: ThreadPoolExecutor):
+        """
+        :return: paths of the fonts installed by their hashes, like {'9f86d0...': '/Library/Fonts/Inter.ttc'}
+        """
+        if self.app.exec.reads_local_files:
+            installed = list_fonts(fonts_dir, recursive=False)
+            return dict(zip(pool.map(self.file_hash, installed), installed))
+        # the folder is out of reach of syscalls, so it's listed and hashed by a single command there
+        cmd = ['find', fonts_dir, '-maxdepth', '1', '-type', 'f', '-exec', 'shasum', '-a', '256', '{}', '+']
+        rc, out = self.app.exec.exec_and_capture(cmd)
+        result = {}
+        for line in out.splitlines():
+            digest, _, path = line.partition('  ')  # like '9f86d0...  /Library/Fonts/Inter.ttc'
+            if path.lower().endswith(EXTENSIONS):
+                result[digest] = path
+        return result
+
+    def index(self):
+        if self._index is None:
+            try:
+                with open(self.app.expand_user(INDEX_FILE), encoding='utf-8') as fd:
+                    self._index = json.load(fd)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def save_index(self, paths: set):
+        """
+        Persist the hashes of `paths`; entries of other files are dropped.
+        """
+        with self._lock:
+            index = {}
+            for path, entry in self.index().items():
+                if path in paths:
+                    index[path] = entry
+            self._index = index
+        index_file = self.app.expand_user(INDEX_FILE)
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(prefix='.fonts.', dir=os.path.dirname(index_file))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(temp_file, index_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _remember_copies(self, files: dict):
+        if self.app.audit.enabled:
+            return
+        for source, target in files.items():
+            st = os.stat(target)  # a sudo copy has an mtime of its own
+            with self._lock:
+                self.index()[target] = [st.st_size, st.st_mtime_ns, self.index()[source][2]]
+
+
+def list_fonts(folder: str, recursive=True):
+    """
+    :return: paths of font files in a folder, like ['/Users/me/fonts/Inter.ttc']
+    """
+    result = []
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        result.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(EXTENSIONS))
+        if not recursive:
+            break
+    return result
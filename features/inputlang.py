@@ -8,6 +8,10 @@ class InputLang:
     def to_plist_xml_str(self):
         raise Exception(f'not overridden for {type(self)}')
 
+    def to_dict(self):
+        """An entry of `AppleEnabledInputSources` as plistlib gives it"""
+        raise Exception(f'not overridden for {type(self)}')
+
     def get_code(self):
         return -1
 
@@ -22,6 +26,9 @@ class KeyboardLang(InputLang):
     def to_plist_xml_str(self):
         return f'<dict><key>InputSourceKind</key><string>Keyboard Layout</string><key>KeyboardLayout ID</key><integer>{self.code}</integer><key>KeyboardLayout Name</key><string>{self.name}</string></dict>'
 
+    def to_dict(self):
+        return {'InputSourceKind': 'Keyboard Layout', 'KeyboardLayout ID': self.code, 'KeyboardLayout Name': self.name}
+
 class NonKeyboardInputMethod(InputLang):
     def __init__(self, bundle_id: str):
         self.bundle_id = bundle_id
@@ -29,6 +36,9 @@ class NonKeyboardInputMethod(InputLang):
     def to_plist_xml_str(self):
         return f'<dict><key>Bundle ID</key><string>{self.bundle_id}</string><key>InputSourceKind</key><string>Non Keyboard Input Method</string></dict>'
 
+    def to_dict(self):
+        return {'Bundle ID': self.bundle_id, 'InputSourceKind': 'Non Keyboard Input Method'}
+
 
 class InputLangs:
     EN_US = KeyboardLang(0, 'U.S.')
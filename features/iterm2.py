@@ -1,4 +1,10 @@
+from features.appprofiles import AppProfiles
+
+
 class Iterm2:
+    """
+    Every setter is a `Defaults.merge`; chain them in a `mac.defaults.batch()` to write the domain once.
+    """
     DOMAIN = 'com.googlecode.iterm2'
 
     def __init__(self, app):
@@ -8,20 +14,20 @@ class Iterm2:
 
     def quit_silently(self):
         """iTerm2: Don't display the annoying prompt when quitting."""
-        self.app.defaults.write(self.DOMAIN, 'PromptOnQuit', False)  # confirm quit iterm2
-        self.app.defaults.write(self.DOMAIN, 'OnlyWhenMoreTabs', False)  # confirm closing multiple sessions
+        self.app.defaults.merge(self.DOMAIN, {
+            'PromptOnQuit': False,  # confirm quit iterm2
+            'OnlyWhenMoreTabs': False,  # confirm closing multiple sessions
+        })
         return self
 
     def quit_when_all_windows_closed(self):
-        self.app.defaults.write(self.DOMAIN, 'QuitWhenAllWindowsClosed', True)
+        self.app.defaults.merge(self.DOMAIN, {'QuitWhenAllWindowsClosed': True})
         return self
 
     def update_disable(self):
-        # todo these settings are the same for a bunch of apps: need to generalize this
-        self.app.defaults.write(self.DOMAIN, 'SUAutomaticallyUpdate', False)
-        self.app.defaults.write(self.DOMAIN, 'SUEnableAutomaticChecks', False)
+        self.app.app_profiles.apply([self.DOMAIN], AppProfiles.UPDATES_OFF)
         return self
 
     def analytics_off(self):
-        self.app.defaults.write(self.DOMAIN, 'SUSendProfileInfo', False)
+        self.app.app_profiles.apply([self.DOMAIN], AppProfiles.ANALYTICS_OFF)
         return self
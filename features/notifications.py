@@ -2,7 +2,8 @@ import logging
 import os
 import plistlib
 
-import util
+# the processes reading ncprefs
+RESTART = ('System Settings', 'NotificationCenter', 'usernoted')
 
 
 class Notifications:
@@ -12,16 +13,34 @@ class Notifications:
         from automac import AutoMac
         app: AutoMac = app
         self.app = app
-        self.do_reload_configs = False
 
     def enable_app(self, app_name):
-        self._enable_app_impl(app_name, True)
+        self.change_apps({app_name: True})
 
     def disable_app(self, app_name):
-        self._enable_app_impl(app_name, False)
+        self.change_apps({app_name: False})
 
     def change_app(self, app_name, enable: bool):
-        self._enable_app_impl(app_name, enable)
+        self.change_apps({app_name: enable})
+
+    def enable_apps(self, *app_names: str):
+        self.change_apps(dict.fromkeys(app_names, True))
+
+    def disable_apps(self, *app_names: str):
+        self.change_apps(dict.fromkeys(app_names, False))
+
+    def change_apps(self, apps: dict):
+        """
+        :param apps: like {'IINA': True, 'Telegram': False}; the apps are resolved by a single osascript
+        """
+        app_paths = {}  # app path -> enable
+        for app_name, enable in apps.items():
+            if app_path := self._resolve_app_path(app_name):
+                app_paths[app_path] = enable
+        bundle_ids = self.app.get_app_bundle_ids(*app_paths)
+        for app_path, enable in app_paths.items():
+            if bundle_id := bundle_ids[app_path]:
+                self._change_ncpref(bundle_id, app_path, enable)
 
     def enable_bundle(self, bundle_id: str, app_path: str = None):
         self._change_ncpref(bundle_id, app_path, True)
@@ -54,7 +73,7 @@ class Notifications:
                             # PlistBuddy requires a file path, not just domain
                             buddy_cmd = f'Set :apps:{i}:flags {new_flags}'
                             self.app.exec.exec(['/usr/libexec/PlistBuddy', '-c', buddy_cmd, plist_file])
-                            self.do_reload_configs = True
+                            self.app.restarts.require(*RESTART)
                     return True
             return False
 
@@ -62,11 +81,12 @@ class Notifications:
             flags = self.flags_base | FLAG_NOTIFICATIONS_ENABLED if enable else self.flags_base
             new_entry_xml = f'<dict><key>auth</key><integer>7</integer><key>bundle-id</key><string>{bundle_id}</string><key>content_visibility</key><integer>0</integer><key>flags</key><integer>{flags}</integer><key>grouping</key><integer>0</integer><key>path</key><string>{app_path}</string><key>src</key><array></array></dict>'
             self.app.exec.exec(['defaults', 'write', 'com.apple.ncprefs.plist', 'apps', '-array-add', new_entry_xml])
-            self.do_reload_configs = True
+            self.app.restarts.require(*RESTART)
 
         FLAG_NOTIFICATIONS_ENABLED = 1 << 25
-        plist_file = f'/Users/{util.get_login()}/Library/Preferences/com.apple.ncprefs.plist'
-        assert os.path.exists(plist_file)
+        plist_file = os.path.join(self.app.home, 'Library/Preferences/com.apple.ncprefs.plist')
+        assert self.app.exec.test('-e', plist_file), plist_file
+        self.app.watcher.track([plist_file], self._change_ncpref, bundle_id, app_path, enable)
         rc, cur_xml_text = self.app.exec.exec_and_capture(['defaults', 'export', plist_file, '-'])
         xml = plistlib.loads(cur_xml_text.encode('utf-8'))
         apps = xml.get('apps') or []
@@ -78,22 +98,18 @@ class Notifications:
                 logging.debug(
                     f'New notification entry cannot be created for bundle id {bundle_id} because app path unknown')
 
-    def _enable_app_impl(self, app_name, enable: bool):
+    def _resolve_app_path(self, app_name):
         def symlink_to_file(path):
             # convert '/Applications/Brave Browser.app/Contents/Frameworks/Brave Browser Framework.framework/Versions/Current/Helpers/Brave Browser Helper (Alerts).app'
             # into '/Applications/Brave Browser.app/Contents/Frameworks/Brave Browser Framework.framework/Versions/129.1.70.123/Helpers/Brave Browser Helper (Alerts).app'
             # because macos uses versioned paths in ncprefs; not sure if it matters
-            return os.path.realpath(path)
+            return self.app.exec.native(['realpath', path], os.path.realpath, path, log=False, probe=True,
+                                        parse=str.strip)
 
         app_path = self.app.apps.find_app_path(app_name)
         if not app_path:
-            logging.warning(f'''Missing app `{app_name}` - it won't be enabled''')
-            return
+            logging.warning(f'''Missing app `{app_name}` - its notifications won't be changed''')
+            return None
         app_path = symlink_to_file(app_path)
-        assert os.path.exists(app_path), f'Missing path: {app_path}'
-        bundle_id = self.app.get_app_bundle_id(app_path)
-        if bundle_id:
-            self._change_ncpref(bundle_id, app_path, enable)
-
-    def os_to_reload_configs(self):
-        self.app.killall('System Settings', 'NotificationCenter', 'usernoted')
+        assert self.app.exec.test('-e', app_path), f'Missing path: {app_path}'
+        return app_path
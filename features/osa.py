@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
+
+CACHE_DIR = '~/Library/Caches/automac/osa'
+BUNDLE_ID_QUERY = 'id of app (item 1 of args)'
+
+
+class OsaQuery:
+    """
+    A pending AppleScript query; its result is available after the batch has run.
+    Reading `result` runs the batch if needed.
+    """
+
+    def __init__(self, batch, text: str, args: list, check: bool):
+        self._batch = batch
+        self.text = text
+        self.args = args
+        self.check = check
+        self.done = False
+        self.value = None
+        self.error = None
+
+    @property
+    def result(self):
+        """:return: the query's value as text, lists are joined by newlines; None on error"""
+        if not self.done:
+            self._batch.run()
+        return self.value
+
+
+class OsaBatch:
+    """
+    Gathers AppleScript queries and runs them as one `osascript` process,
+    as starting osascript costs way more than running a query.
+
+    Usage:
+        batch = mac.exec.osa_batch()
+        iina = batch.add('id of app (item 1 of args)', 'IINA')
+        subl = batch.add('id of app (item 1 of args)', 'Sublime Text')
+        print(iina.result, subl.result)  # one osascript for both
+    """
+    SEPARATOR = '\x1e'  # ASCII record separator
+
+    def __init__(self, exec_, probe=True):
+        """
+        :param probe: True if the queries only read, so they run in audit mode too
+        """
+        self.exec = exec_
+        self.probe = probe
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.run()
+
+    def add(self, text: str, *args: str, check=True):
+        """
+        :param text: one or more AppleScript statements; the result of the last one is returned
+        :param args: parameters seen by the query as list `args`; they make the script text constant,
+            so its compiled form is reused
+        :param check: abort if the query fails
+        """
+        assert text
+        query = OsaQuery(self, text, [str(arg) for arg in args], check)
+        self._pending.append(query)
+        return query
+
+    def run(self):
+        queries, self._pending = self._pending, []
+        if not queries:
+            return
+        rc, out = self.exec.exec_osa_script(self._compose(queries), check=False, log=False, probe=self.probe,
+                                            args=[arg for query in queries for arg in query.args])
+        parts = out.split(self.SEPARATOR) if rc == 0 else []
+        if len(parts) != len(queries):
+            # like a syntax error in one of them: no query has run, so run them one by one
+            logging.debug(f'AppleScript batch of {len(queries)} failed, running queries separately')
+            for query in queries:
+                rc, out = self.exec.exec_osa_script(self._compose([query]), check=False, log=False,
+                                                    probe=self.probe, args=query.args)
+                self._complete_part(query, out) if rc == 0 else self._complete(query, rc, out)
+            return
+        for query, part in zip(queries, parts):
+            self._complete_part(query, part)
+
+    def _complete_part(self, query: OsaQuery, part: str):
+        self._complete(query, 0 if part.startswith('ok') else 1, part[2:])
+
+    def _complete(self, query: OsaQuery, rc: int, out: str):
+        query.done = True
+        if rc == 0:
+            query.value = out
+        else:
+            query.error = out or f'exit code {rc}'
+            if query.check:
+                self.exec.app.abort(f'AppleScript failed: {query.text} - {query.error}')
+
+    def _compose(self, queries: list):
+        lines = [
+            'on run argv',
+            'set automacResults to {}',
+            'set AppleScript\'s text item delimiters to linefeed',  # for list results
+        ]
+        first_arg = 1
+        for query in queries:
+            if query.args:
+                last_arg = first_arg + len(query.args) - 1
+                lines.append(f'set args to items {first_arg} thru {last_arg} of argv')
+                first_arg = last_arg + 1
+            else:
+                lines.append('set args to {}')
+            lines += [
+                'set automacValue to ""',  # so `result` isn't left from the previous query
+                'try',
+                query.text,
+                'try',
+                'set automacValue to (result as text)',
+                'on error',
+                'set automacValue to ""',  # no result or not convertible
+                'end try',
+                'set end of automacResults to "ok" & automacValue',
+                'on error errMsg',
+                'set end of automacResults to "er" & errMsg',
+                'end try',
+            ]
+        lines += [
+            f'set AppleScript\'s text item delimiters to (ASCII character {ord(self.SEPARATOR)})',
+            'return automacResults as text',
+            'end run',
+        ]
+        return '\n'.join(lines)
+
+
+def compile_cached(exec_, text: str) -> Optional[str]:
+    """
+    Compile a script by `osacompile` once; later calls, in this run or the next ones, reuse it.
+    Compiled scripts are named by a hash of the source, so a changed script never hits a stale one.
+    :return: path to the compiled script; None if it cannot be compiled
+    """
+    cache_dir = os.path.expanduser(CACHE_DIR)
+    path = os.path.join(cache_dir, hashlib.sha256(text.encode('utf-8')).hexdigest() + '.scpt')
+    if os.path.exists(path):
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, source = tempfile.mkstemp(suffix='.applescript', dir=cache_dir)
+    compiled = source[:-len('.applescript')] + '.scpt'
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        rc, _ = exec_.exec_and_capture(['osacompile', '-o', compiled, source], check=False)
+        if rc != 0:
+            return None
+        # another thread may be compiling the same script, both results are fine
+        os.replace(compiled, path)
+        return path
+    finally:
+        for temp in (source, compiled):
+            if os.path.exists(temp):
+                os.remove(temp)
@@ -0,0 +1,95 @@
+import logging
+import re
+from typing import Union
+
+# `pmset -g custom` section titles
+SOURCES = {'AC Power': 'ac', 'Battery Power': 'battery', 'UPS Power': 'ups'}
+
+
+class PowerManagement:
+    """
+    Energy settings, like `pmset` does them: sleep, displaysleep, powernap, lidwake...
+    All settings are read by one `pmset` call, changes are written by one sudo.
+
+    Usage:
+        mac.power.write_all_if_needed({'displaysleep': 10, 'powernap': False})  # every power source
+        mac.power.write_profile_if_needed({'ac': {'sleep': 0}, 'battery': {'sleep': 15}})
+    """
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+
+    def read_all(self):
+        """
+        :return: like {'ac': {'sleep': 1, 'displaysleep': 10, ...}, 'battery': {...}};
+            the power sources this Mac has only
+        """
+        return self.app.backends.sysconfig.power_settings()
+
+    def read(self, key: str, source='ac'):
+        """:return: like 10; None if missing"""
+        return self.read_all().get(source, {}).get(key)
+
+    def write_if_needed(self, key: str, value: Union[int, bool], source: str = None):
+        self.write_all_if_needed({key: value}, source)
+
+    def write_all_if_needed(self, values: dict, source: str = None):
+        """
+        :param values: like {'displaysleep': 10, 'powernap': False}
+        :param source: 'ac', 'battery' or 'ups'; every source of this Mac if None
+        """
+        if source:
+            self.write_profile_if_needed({source: values})
+        else:
+            current = self.read_all()
+            self.write_profile_if_needed({source: values for source in current}, current)
+
+    def write_profile_if_needed(self, profile: dict, current: dict = None):
+        """
+        Change the settings differing from `profile`, by a single privileged call.
+        :param profile: like {'ac': {'sleep': 0}, 'battery': {'sleep': 15}}
+        :param current: the settings just read by `read_all`, to not read them again
+        """
+        for source in profile:
+            assert source in SOURCES.values(), f'Unknown power source: {source}'
+        sysconfig = self.app.backends.sysconfig
+        if current is None:
+            current = sysconfig.power_settings()
+        with self.app.exec.sudo_batch():
+            for source, values in profile.items():
+                if source not in current:
+                    logging.debug(f'No {source} power source, skipping')
+                    continue
+                values = {key: int(value) for key, value in values.items()}
+                changes = {key: value for key, value in values.items() if current[source].get(key) != value}
+                if changes:
+                    sysconfig.set_power(source, changes)
+
+
+def parse_pmset_custom(text: str):
+    """
+    Parse the output of `pmset -g custom`:
+        Battery Power:
+         lidwake              1
+         displaysleep         2
+        AC Power:
+         Sleep On Power Button 1
+         sleep                1 (sleep prevented by sharingd)
+    :return: like {'battery': {'lidwake': 1, 'displaysleep': 2}, 'ac': {'Sleep On Power Button': 1, 'sleep': 1}}
+    """
+    result = {}
+    table = None
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            title = line.strip().rstrip(':')
+            table = result.setdefault(SOURCES[title], {}) if title in SOURCES else None
+            continue
+        # names may contain spaces; values may be followed by a note
+        m = re.fullmatch(r'\s*(.+?)\s+(-?\d+)(\s.*)?', line)
+        if table is not None and m:
+            table[m.group(1)] = int(m.group(2))
+    return result
@@ -0,0 +1,99 @@
+import datetime
+import hashlib
+import logging
+import plistlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Profile:
+    """
+    A golden profile: every preference key a config manages, captured on a reference machine
+    into one file, then applied to fresh machines a domain at a time instead of a key at a time.
+
+    On the reference machine, after the config ran:
+        mac.profile.export('golden.plist')
+    On a new machine:
+        mac.profile.apply('golden.plist')
+
+    Only keys written by `Defaults` (or registered by `Defaults.touch`) are captured;
+    the rest of a domain is kept as is on the target machine.
+    """
+    FORMAT = 1
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+
+    def export(self, path: str):
+        """
+        Write the managed keys of every domain the config has touched so far.
+        """
+        defaults = self.app.defaults
+        domains = []
+        for (domain, current_host), (keys, sudo) in sorted(defaults.touched_domains().items()):
+            current = self.app.backends.prefs.export(domain, current_host=current_host)
+            values = {key: current[key] for key, written in keys.items() if written and key in current}
+            # a key the config deletes stays a deletion, even if this machine still has it
+            absent = sorted(key for key, written in keys.items() if not written or key not in current)
+            kept = sorted(key for key, written in keys.items() if not written and key in current)
+            if kept:
+                logging.warning(f'Profile: {domain} still has keys the config deletes, exported as deleted: '
+                                f'{", ".join(kept)}')
+            domains.append({
+                'domain': domain,
+                'current_host': current_host,
+                'sudo': sudo,
+                'values': values,
+                'absent': absent,
+                'sha256': _digest(values, absent),
+            })
+        bundle = {
+            'format': self.FORMAT,
+            'created': datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+            'os_version': self.app.get_mac_version_str(),
+            'domains': domains,
+        }
+        with open(path, 'wb') as fd:
+            plistlib.dump(bundle, fd, fmt=plistlib.FMT_BINARY)
+        logging.info(f'Profile of {len(domains)} domains, {sum(len(d["values"]) for d in domains)} keys: {path}')
+
+    def apply(self, path: str, max_workers=8):
+        """
+        Merge a profile into this machine: a domain already matching the profile costs a single read,
+        a differing one a read and a single import.
+        """
+        with open(path, 'rb') as fd:
+            bundle = plistlib.load(fd)
+        if bundle.get('format') != self.FORMAT:
+            self.app.abort(f'Unsupported profile format {bundle.get("format")}: {path}')
+        os_version = self.app.get_mac_version_str()
+        if bundle['os_version'] != os_version:
+            logging.warning(f'Profile made on macos {bundle["os_version"]}, this is {os_version}')
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            changed = sum(pool.map(self._apply_domain, bundle['domains']))
+        logging.info(f'Profile applied: {changed} of {len(bundle["domains"])} domains changed')
+
+    def _apply_domain(self, entry: dict):
+        """
+        :return: True if the domain was changed
+        """
+        domain, current_host = entry['domain'], entry['current_host']
+        prefs = self.app.backends.prefs
+        current = prefs.export(domain, current_host=current_host)
+        values = {key: current[key] for key in entry['values'] if key in current}
+        absent = [key for key in entry['absent'] if key not in current]
+        if _digest(values, absent) == entry['sha256']:
+            return False
+        merged = {key: value for key, value in current.items() if key not in entry['absent']}
+        merged.update(entry['values'])
+        prefs.import_domain(domain, merged, current_host=current_host, sudo=entry['sudo'])
+        return True
+
+
+def _digest(values: dict, absent: list):
+    """
+    A hash of the managed part of a domain; equal hashes mean nothing to do.
+    """
+    data = plistlib.dumps({'values': values, 'absent': sorted(absent)}, sort_keys=True)
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,45 @@
+import logging
+import threading
+
+# restarted in this order: the preferences daemon before the apps reading preferences from it
+ORDER = ('cfprefsd', 'Dock', 'Finder', 'SystemUIServer', 'ControlCenter', 'NotificationCenter', 'usernoted',
+         'System Settings')
+
+
+class Restarts:
+    """
+    Apps and daemons to be restarted, so they reload the settings changed.
+    A write requires restarts, they happen once per run: at the end of it or at a checkpoint.
+
+    Usage:
+        mac.defaults.write('com.apple.dock', 'orientation', 'left', restart=['Dock'])
+        mac.restarts.run()  # a checkpoint; optional
+    """
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self.pending = []
+        self._lock = threading.Lock()
+
+    def require(self, *names: str):
+        """
+        :param names: process names for `killall`, like 'Dock'
+        """
+        with self._lock:
+            for name in names:
+                if name not in self.pending:
+                    self.pending.append(name)
+
+    def run(self):
+        """
+        Restart what the writes so far require; nothing in audit mode, as nothing was written.
+        """
+        with self._lock:
+            names = sorted(self.pending, key=lambda name: ORDER.index(name) if name in ORDER else len(ORDER))
+            self.pending = []
+        if not names or self.app.audit.enabled:
+            return
+        logging.debug(f'Restarting: {", ".join(names)}')
+        self.app.killall(*names)
@@ -0,0 +1,163 @@
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Step:
+    """
+    A single unit of configuration work, like installing a cask or writing a couple of preferences.
+    """
+
+    def __init__(self, name: str, func, args: tuple, kwargs: dict, after=(), provides=(), requires=(), domains=()):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.after = set(after)
+        self.provides = set(provides) | {f'domain:{domain}' for domain in domains}
+        self.requires = set(requires)
+        self.domains = sorted(set(domains))
+        self.deps = set()  # names of steps this one waits for; resolved in `Scheduler.run`
+        self.status = 'pending'  # pending, ok, failed, skipped
+        self.error = None
+        self.duration = 0.0
+
+
+class Scheduler:
+    """
+    Runs configuration steps as a dependency graph, independent steps in parallel.
+
+    Dependencies are either explicit (`after`, step names) or inferred from resources:
+    a step that `requires` a resource, like 'app:IINA' or 'domain:com.apple.dock',
+    waits for every step that `provides` it. Declaring `domains` both provides 'domain:<name>'
+    and serializes the step with other steps writing to the same preference domain.
+
+    Caches shared by features are locked, so any AutoMac method may run in a step. A preference domain
+    is still read and rewritten as a whole by some methods, like `Defaults.merge`: declare `domains`
+    for steps sharing a domain.
+
+    A failed step only skips the steps depending on it; the rest of the graph still runs.
+    That holds across `run` calls too: a step added later and depending on a failed one is skipped.
+    """
+
+    def __init__(self, app, max_workers=4):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self.max_workers = max_workers
+        self.steps = {}  # type: dict[str, Step]
+        self._domain_locks = {}  # type: dict[str, threading.Lock]
+        self._domain_locks_guard = threading.Lock()
+
+    def step(self, name: str, func, *args, after=(), provides=(), requires=(), domains=(), **kwargs):
+        """
+        Declare a step; it will be executed by `run`.
+        :param name: unique step name, like 'cask iina'
+        :param func: a callable, like `mac.brew.install_cask`
+        :param after: names of steps to be completed before this one
+        :param provides: resources this step makes available, like 'app:IINA'
+        :param requires: resources this step needs, like 'app:IINA' or 'domain:com.apple.dock'
+        :param domains: preference domains written by this step, like 'com.apple.dock'
+        """
+        assert name not in self.steps, f'Duplicate step: {name}'
+        assert callable(func), name
+        self.steps[name] = Step(name, func, args, kwargs, after=after, provides=provides, requires=requires,
+                                domains=domains)
+        return self
+
+    def run(self):
+        """
+        Execute all pending steps with bounded parallelism.
+        :return: a list of failed or skipped steps, empty on success
+        """
+        steps = {name: step for name, step in self.steps.items() if step.status == 'pending'}
+        if not steps:
+            return []
+        self._resolve_deps(steps)
+        self._check_cycles(steps)
+        logging.debug(f'Scheduler: {len(steps)} steps, {self.max_workers} workers')
+        waiting = dict(steps)
+        running = {}  # future -> step
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='automac-step') as pool:
+            while waiting or running:
+                for step in list(waiting.values()):
+                    dep_statuses = {self.steps[dep].status for dep in step.deps}
+                    if dep_statuses & {'failed', 'skipped'}:
+                        step.status = 'skipped'
+                        logging.warning(f'Step skipped because of a failed dependency: {step.name}')
+                        del waiting[step.name]
+                    elif not (dep_statuses & {'pending'}):
+                        del waiting[step.name]
+                        running[pool.submit(self._run_step, step)] = step
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+        failed = [step for step in steps.values() if step.status != 'ok']
+        for step in failed:
+            logging.error(f'Step {step.status}: {step.name}' + (f' - {step.error}' if step.error else ''))
+        if failed:
+            self.app.success = False
+        logging.debug(f'Scheduler: {len(steps) - len(failed)} steps ok, {len(failed)} not')
+        return failed
+
+    def _run_step(self, step: Step):
+        locks = [self._domain_lock(domain) for domain in step.domains]
+        started = time.monotonic()
+        for lock in locks:  # sorted by domain name, so no deadlocks
+            lock.acquire()
+        try:
+            step.func(*step.args, **step.kwargs)
+            step.status = 'ok'
+        except SystemExit:
+            # XXX `AutoMac.abort` exits via SystemExit, it must not kill the whole graph; the reason is logged
+            step.status = 'failed'
+            step.error = 'aborted'
+        except Exception as e:
+            step.status = 'failed'
+            step.error = str(e) or type(e).__name__
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+            step.duration = time.monotonic() - started
+        logging.debug(f'Step {step.status} in {step.duration:.2f}s: {step.name}')
+
+    def _domain_lock(self, domain: str):
+        with self._domain_locks_guard:
+            return self._domain_locks.setdefault(domain, threading.Lock())
+
+    def _resolve_deps(self, steps: dict):
+        """
+        Resolve the pending `steps` against all steps, so steps done by an earlier `run` count too.
+        """
+        providers = {}  # resource -> step names
+        for step in self.steps.values():
+            for resource in step.provides:
+                providers.setdefault(resource, set()).add(step.name)
+        for step in steps.values():
+            for dep in step.after:
+                assert dep in self.steps, f'Step `{step.name}` depends on unknown step `{dep}`'
+            step.deps = set(step.after)
+            for resource in step.requires:
+                # no provider means the resource is expected to exist already
+                step.deps |= providers.get(resource, set()) - {step.name}
+
+    def _check_cycles(self, steps: dict):
+        visiting, visited = set(), set()
+
+        def visit(name, path):
+            if name in visited:
+                return
+            if name in visiting:
+                self.app.abort(f'Step dependency cycle: {" -> ".join(path + [name])}')
+            visiting.add(name)
+            for dep in steps[name].deps:
+                if dep in steps:  # steps of an earlier run are done, so no cycle through them
+                    visit(dep, path + [name])
+            visiting.discard(name)
+            visited.add(name)
+
+        for step_name in steps:
+            visit(step_name, [])
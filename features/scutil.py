@@ -1,3 +1,6 @@
+import re
+
+
 class Scutil:
 
     def __init__(self, app):
@@ -6,10 +9,34 @@ class Scutil:
         self.app = app
 
     def write_if_needed(self, key: str, value: str):
-        # XXX scutil exits with a non-zero code if setting missing
-        rc, old_value = self.app.exec.exec_and_capture(['scutil', '--get', key], check=False)
-        if rc == 0 and old_value == value:
-            # print(f'Already done: scutil {key} {value}')
-            pass
-        else:
-            self.app.exec.sudo(['scutil', '--set', key, value])
+        self.write_all_if_needed({key: value})
+
+    def write_all_if_needed(self, values: dict):
+        """
+        Write several scutil settings in one privileged call, only the changed ones.
+        :param values: like {'ComputerName': 'bmp', 'LocalHostName': 'bmp'}
+        """
+        if 'LocalHostName' in values:
+            self.check_local_host_name(values['LocalHostName'])
+        sysconfig = self.app.backends.sysconfig
+        old_values = sysconfig.get_all(values.keys())
+        with self.app.exec.sudo_batch():
+            for key, value in values.items():
+                if old_values.get(key) != value:
+                    sysconfig.set(key, value)
+
+    def read_all(self, keys):
+        """
+        Read scutil settings at once.
+        :return: like {'ComputerName': 'bmp', 'HostName': None}; None for a missing setting
+        """
+        return self.app.backends.sysconfig.get_all(keys)
+
+    def read(self, key: str):
+        return self.read_all([key])[key]
+
+    def check_local_host_name(self, name: str):
+        # dots or underscores lead to scutil error 'Invalid argument'
+        if not re.fullmatch(r'[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?', name):
+            self.app.abort(f'Improper LocalHostName `{name}`: only letters, digits and inner hyphens allowed, '
+                           'up to 63 chars')
@@ -0,0 +1,127 @@
+import logging
+import os
+import platform
+import pwd
+import shlex
+import subprocess
+import threading
+from typing import Union
+
+import util
+
+
+class Transport:
+    """
+    Where commands run: `Exec` starts every process through a transport.
+    """
+    local = True  # False if syscalls of this process don't act as the target: another machine or another user
+    user = None  # a login the commands run as; None for the current one
+    home = None  # HOME of the commands; None for the current one
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def popen(self, cmd: Union[str, list], shell=False, **kwargs) -> subprocess.Popen:
+        """
+        Start a command; `kwargs` are those of `subprocess.Popen`.
+        """
+        raise Exception('not implemented')
+
+    def close(self):
+        pass
+
+
+class LocalTransport(Transport):
+    """
+    This machine. `env` and `cwd` let many simulated hosts share one machine, each with a home of its own.
+    """
+
+    def __init__(self, name='localhost', env: dict = None, cwd: str = None):
+        super().__init__(name)
+        self.env = {**os.environ, **env} if env else None
+        self.cwd = cwd
+        if env and env.get('HOME'):
+            self.home = env['HOME']
+
+    def popen(self, cmd: Union[str, list], shell=False, **kwargs):
+        return subprocess.Popen(cmd, shell=shell, env=self.env, cwd=self.cwd, **kwargs)
+
+
+class UserTransport(LocalTransport):
+    """
+    Another account of this machine: commands run as that user, in their login session
+    (`launchctl asuser`, so preferences go to their cfprefsd) with their HOME.
+    Commands starting with `sudo` run as they are. Requires running as root.
+    """
+
+    def __init__(self, login: str):
+        super().__init__(login)
+        entry = pwd.getpwnam(login)
+        self.user = login
+        self.uid = entry.pw_uid
+        self.home = entry.pw_dir
+        self.local = login == util.get_login()
+        if not self.local and os.geteuid() != 0:
+            raise PermissionError(f'Root required to act as {login}')
+
+    def popen(self, cmd: Union[str, list], shell=False, **kwargs):
+        if self.local or (cmd[:1] == ['sudo'] if isinstance(cmd, list) else cmd.startswith('sudo ')):
+            return super().popen(cmd, shell=shell, **kwargs)
+        if isinstance(cmd, str):
+            cmd = ['/bin/sh', '-c', cmd] if shell else shlex.split(cmd)
+        prefix = ['launchctl', 'asuser', str(self.uid)] if platform.system() == 'Darwin' else []
+        return super().popen(prefix + ['sudo', '-u', self.user, '-H', '--'] + cmd, **kwargs)
+
+
+class SshTransport(Transport):
+    """
+    A remote Mac over ssh. All commands go through one connection (ssh ControlMaster),
+    so a command costs a new channel rather than a new TCP connection and handshake.
+
+    Key-based auth required; `sudo` needs NOPASSWD on the remote host, as there's no terminal to ask.
+    """
+    local = False
+
+    def __init__(self, host: str, ssh='ssh', options: list = (), persist=600, control_dir='~/.ssh'):
+        """
+        :param host: like 'admin@mini1.local'
+        :param options: extra ssh options, like ['-p', '2222']
+        :param persist: seconds the connection is kept idle after the last command
+        """
+        super().__init__(host)
+        self.host = host
+        self.ssh = ssh
+        self.options = list(options)
+        self.persist = persist
+        # %C is a hash of the connection params; socket paths are limited to ~100 chars
+        self.control_path = os.path.join(os.path.expanduser(control_dir), 'automac-%C')
+        self._master = False
+        self._lock = threading.Lock()
+
+    def _ssh(self, *args: str):
+        return [self.ssh, '-o', f'ControlPath={self.control_path}', '-o', 'BatchMode=yes', *self.options, *args]
+
+    def _connect(self):
+        with self._lock:
+            if self._master:
+                return
+            # -f: go background once authenticated, so the first command waits for the connection
+            cmd = self._ssh('-o', 'ControlMaster=yes', '-o', f'ControlPersist={self.persist}', '-fN', self.host)
+            rc = subprocess.run(cmd, stdin=subprocess.DEVNULL).returncode
+            if rc != 0:
+                raise OSError(f'Cannot connect to {self.host}: ssh exited with code {rc}')
+            self._master = True
+
+    def popen(self, cmd: Union[str, list], shell=False, **kwargs):
+        self._connect()
+        # the remote shell parses the command; killing the local ssh on a timeout closes the channel
+        remote_cmd = cmd if isinstance(cmd, str) else shlex.join(cmd)
+        return subprocess.Popen(self._ssh('-T', self.host, '--', remote_cmd), **kwargs)
+
+    def close(self):
+        with self._lock:
+            if self._master:
+                subprocess.run(self._ssh('-O', 'exit', self.host), stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                self._master = False
+                logging.debug(f'Disconnected from {self.host}')
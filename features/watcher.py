@@ -0,0 +1,215 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import sys
+import threading
+import time
+
+
+class Watcher:
+    """
+    Keeps settings enforced after the config has been applied once.
+
+    Every operation that changes a file (a preference plist, ncprefs, a symlink, /etc/shells)
+    registers itself with `track`. Then `run` sleeps until one of those files changes
+    and re-checks only the operations that touched it.
+    """
+
+    def __init__(self, app):
+        from automac import AutoMac
+        app: AutoMac = app
+        self.app = app
+        self.ops = {}  # op key -> (paths, func, args, kwargs)
+        self._lock = threading.Lock()  # tracked by scheduler steps in parallel
+
+    def track(self, paths: list, func, *args, **kwargs):
+        """
+        Remember an operation to be re-checked when any of `paths` changes.
+        Calling it again for the same operation changes nothing, so re-checks are safe.
+        """
+        key = (func.__qualname__, repr(args), repr(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self.ops:
+                self.ops[key] = ([self.app.expand_user(path) for path in paths], func, args, kwargs)
+
+    def run(self, debounce=1.0, backend=None):
+        """
+        Watch the tracked files forever, restoring settings when they drift.
+        :param debounce: seconds to wait for a writer to finish before re-checking
+        :param backend: a `WatchBackend`; the best one for the OS by default
+        """
+        with self._lock:
+            ops = list(self.ops.values())
+        paths = sorted({path for paths, _, _, _ in ops for path in paths})
+        if not paths:
+            logging.warning('Nothing to watch')
+            return
+        backend = backend or make_backend()
+        backend.watch(paths)
+        logging.info(f'Watching {len(paths)} files for {len(ops)} operations with {type(backend).__name__}')
+        signatures = {path: file_signature(path) for path in paths}
+        while True:
+            backend.wait()
+            time.sleep(debounce)
+            backend.drain()
+            changed = {path for path in paths if file_signature(path) != signatures[path]}
+            if not changed:
+                continue
+            logging.info(f'Changed: {", ".join(sorted(changed))}')
+            self.app.facts.clear()  # probed before the change
+            for op_paths, func, args, kwargs in ops:
+                if changed.intersection(op_paths):
+                    self._recheck(func, args, kwargs)
+            self.app.restarts.run()
+            # skip the events caused by our own writes
+            time.sleep(debounce)
+            backend.drain()
+            backend.watch(paths)
+            signatures = {path: file_signature(path) for path in paths}
+
+    def _recheck(self, func, args, kwargs):
+        try:
+            func(*args, **kwargs)
+        except (Exception, SystemExit) as e:
+            # XXX `AutoMac.abort` exits via SystemExit, the daemon must survive it
+            logging.error(f'Re-check failed: {func.__qualname__}{args} - {e}')
+
+
+def file_signature(path: str):
+    """
+    Something that changes whenever a file is written, replaced or removed.
+    """
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode
+
+
+def make_backend():
+    if hasattr(select, 'kqueue'):
+        return KqueueBackend()
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyBackend()
+        except OSError as e:
+            logging.debug(f'inotify not available: {e}')
+    return PollingBackend()
+
+
+def _dirs_to_watch(paths: list):
+    """
+    Watching folders catches files replaced by a rename, the way cfprefsd saves plists.
+    """
+    dirs = set()
+    for path in paths:
+        parent = os.path.dirname(path)
+        while not os.path.isdir(parent):
+            parent = os.path.dirname(parent)
+        dirs.add(parent)
+    return sorted(dirs)
+
+
+class WatchBackend:
+    def watch(self, paths: list):
+        """Start or restart watching the given files."""
+        raise Exception('not implemented')
+
+    def wait(self):
+        """Block until some of the files may have changed."""
+        raise Exception('not implemented')
+
+    def drain(self):
+        """Forget pending events."""
+        pass
+
+
+class KqueueBackend(WatchBackend):
+    O_EVTONLY = getattr(os, 'O_EVTONLY', 0x8000)  # macos: open for notifications only
+
+    def __init__(self):
+        self._kq = select.kqueue()
+        self._fds = []
+
+    def watch(self, paths: list):
+        for fd in self._fds:
+            os.close(fd)  # closing a descriptor removes its kevents
+        self._fds = []
+        events = []
+        # a file itself for in-place writes, like /etc/shells; its folder for replacements
+        for path in _dirs_to_watch(paths) + [path for path in paths if os.path.exists(path)]:
+            try:
+                fd = os.open(path, self.O_EVTONLY)
+            except OSError as e:
+                logging.debug(f'Cannot watch {path}: {e}')
+                continue
+            self._fds.append(fd)
+            events.append(select.kevent(
+                fd, filter=select.KQ_FILTER_VNODE, flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                fflags=select.KQ_NOTE_WRITE | select.KQ_NOTE_EXTEND | select.KQ_NOTE_ATTRIB
+                | select.KQ_NOTE_DELETE | select.KQ_NOTE_RENAME))
+        self._kq.control(events, 0)
+
+    def wait(self):
+        self._kq.control(None, 64, None)
+
+    def drain(self):
+        while self._kq.control(None, 64, 0):
+            pass
+
+
+class InotifyBackend(WatchBackend):
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def watch(self, paths: list):
+        mask = self.IN_MODIFY | self.IN_ATTRIB | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        for path in _dirs_to_watch(paths):
+            # watching a folder reports changes of its files too; adding it twice is harmless
+            if self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+                logging.debug(f'Cannot watch {path}: {os.strerror(ctypes.get_errno())}')
+
+    def wait(self):
+        select.select([self._fd], [], [])
+
+    def drain(self):
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+
+
+class PollingBackend(WatchBackend):
+    """
+    A fallback for systems with no file notifications; costs a stat per file per interval.
+    """
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self._paths = []
+        self._signatures = {}
+
+    def watch(self, paths: list):
+        self._paths = paths
+        self._signatures = {path: file_signature(path) for path in paths}
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+            if any(file_signature(path) != self._signatures[path] for path in self._paths):
+                return
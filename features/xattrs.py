@@ -0,0 +1,81 @@
+"""
+Parallel, process-free handling of extended attributes over whole directory trees, like app bundles.
+Works on Linux too, with `user.*` attributes, which is handy for testing.
+"""
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import util
+
+QUARANTINE = 'com.apple.quarantine'
+
+
+def remove_recursive(root: str, name: str, max_workers=8):
+    """
+    Remove attribute `name` from `root` and every file beneath it; an equivalent of `xattr -dr name root`.
+    :return: (a number of cleaned files, a list of paths failed to clean)
+    """
+    return _walk(root, name, remove=True, max_workers=max_workers)
+
+
+def exists_recursive(root: str, name: str, max_workers=8):
+    """
+    Check whether `root` or any file beneath it has attribute `name`.
+    Stops walking at the first file found.
+    """
+    found, _ = _walk(root, name, remove=False, max_workers=max_workers)
+    return found > 0
+
+
+def _walk(root: str, name: str, remove: bool, max_workers: int):
+    stop = threading.Event()
+    failed = []
+    failed_lock = threading.Lock()
+
+    def handle(path):
+        """:return: 1 if the attribute found (and removed), 0 otherwise"""
+        try:
+            if name not in util.list_xattrs(path, follow_symlinks=False):
+                return 0
+            if remove:
+                util.remove_xattr(path, name, follow_symlinks=False)
+            else:
+                stop.set()
+            return 1
+        except FileNotFoundError:
+            return 0  # removed meanwhile
+        except OSError:
+            with failed_lock:
+                failed.append(path)
+            return 0
+
+    def visit(dir_path):
+        subdirs = []
+        found = 0
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if stop.is_set():
+                        break
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    found += handle(entry.path)
+        except OSError:
+            with failed_lock:
+                failed.append(dir_path)
+        return subdirs, found
+
+    total = handle(root)
+    if not os.path.isdir(root) or os.path.islink(root) or stop.is_set():
+        return total, failed
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='automac-xattr') as pool:
+        pending = {pool.submit(visit, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, found = future.result()
+                total += found
+                if not stop.is_set():
+                    pending |= {pool.submit(visit, subdir) for subdir in subdirs}
+    return total, failed
@@ -1,4 +1,9 @@
+import ctypes
+import ctypes.util
+import errno
+import functools
 import getpass
+import hashlib
 import os
 import platform
 import re
@@ -41,6 +46,72 @@ def app_name_to_base_name_without_ext(s: str):
     return s
 
 
+def hash_file(path, chunk_size=1024 * 1024):
+    """
+    SHA-256 of a file's content, read in chunks so big files don't fill the memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        while chunk := fd.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def get_os_name():
     s = platform.system()
     return {'Darwin': 'macOS'}.get(s) or s
+
+
+XATTR_NOFOLLOW = 0x0001  # macos, <sys/xattr.h>
+
+
+@functools.lru_cache(maxsize=None)
+def _libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    libc.listxattr.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_size_t, ctypes.c_int]
+    libc.listxattr.restype = ctypes.c_ssize_t
+    libc.removexattr.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+    libc.removexattr.restype = ctypes.c_int
+    return libc
+
+
+def _raise_errno(path):
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err), path)
+
+
+def list_xattrs(path, follow_symlinks=True):
+    """
+    List extended attribute names of a file, no process spawned.
+    Python has `os.listxattr` on Linux only, so calling libc directly on macos.
+    """
+    if hasattr(os, 'listxattr'):
+        return os.listxattr(path, follow_symlinks=follow_symlinks)
+    libc = _libc()
+    path_b = os.fsencode(path)
+    options = 0 if follow_symlinks else XATTR_NOFOLLOW
+    while True:
+        size = libc.listxattr(path_b, None, 0, options)
+        if size < 0:
+            _raise_errno(path)
+        if size == 0:
+            return []
+        buf = ctypes.create_string_buffer(size)
+        size = libc.listxattr(path_b, buf, size, options)
+        if size < 0:
+            if ctypes.get_errno() == errno.ERANGE:
+                continue  # attributes were added meanwhile
+            _raise_errno(path)
+        return [os.fsdecode(name) for name in buf.raw[:size].split(b'\0') if name]
+
+
+def remove_xattr(path, name: str, follow_symlinks=True):
+    """
+    Remove an extended attribute from a file, no process spawned.
+    """
+    if hasattr(os, 'removexattr'):
+        os.removexattr(path, name, follow_symlinks=follow_symlinks)
+        return
+    options = 0 if follow_symlinks else XATTR_NOFOLLOW
+    if _libc().removexattr(os.fsencode(path), os.fsencode(name), options) != 0:
+        _raise_errno(path)